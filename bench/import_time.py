@@ -0,0 +1,72 @@
+"""Import time benchmark of symcode.
+
+Measures, in fresh interpreters, the time to import symcode and
+symcode.runtime (which must not import sympy) against a bare interpreter
+start, and the time of the first use of the codegen part. Exits with an
+error if the runtime import is over --max-ms or imports sympy.
+
+    python bench/import_time.py [--repeat N] [--max-ms MS]
+
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+cases = [
+    ('interpreter', 'pass'),
+    ('symcode', 'import symcode'),
+    ('symcode.runtime', 'import symcode.runtime'),
+    ('symcode.generation', 'import symcode; symcode.generation'),
+]
+
+
+def run(statement, repeat):
+    """Best wall time (s) of running statement in a fresh interpreter."""
+
+    env = dict(os.environ)
+    env['PYTHONPATH'] = root + os.pathsep + env.get('PYTHONPATH', '')
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        subprocess.check_call([sys.executable, '-c', statement], env=env)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description='symcode import time benchmark')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--max-ms', type=float, default=100.0,
+                        help='maximum import time of symcode.runtime over a bare interpreter')
+    args = parser.parse_args()
+
+    times = dict((name, run(statement, args.repeat)) for name, statement in cases)
+    for name, statement in cases:
+        print('%-20s %8.1f ms  (+%.1f ms)' % (name, 1000*times[name], 1000*(times[name] - times['interpreter'])))
+
+    failed = False
+
+    check = 'import sys, symcode, symcode.runtime; sys.exit(int("sympy" in sys.modules))'
+    env = dict(os.environ, PYTHONPATH=root + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    if subprocess.call([sys.executable, '-c', check], env=env):
+        print('FAIL: importing symcode.runtime imports sympy')
+        failed = True
+
+    overhead = 1000*(times['symcode.runtime'] - times['interpreter'])
+    if overhead > args.max_ms:
+        print('FAIL: symcode.runtime import takes %.1f ms > %.1f ms' % (overhead, args.max_ms))
+        failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
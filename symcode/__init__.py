@@ -1,9 +1,30 @@
-"""Library to collect sub-expressions from SymPy expressions and generate C and Python code."""
+"""Library to collect sub-expressions from SymPy expressions and generate C and Python code.
+
+Submodules are imported on first use, so that importing symcode (and
+symcode.runtime, which loads previously generated kernels) does not import
+SymPy. Before Python 3.7, which lacks module __getattr__, they are all
+imported eagerly.
+
+"""
+
+import importlib
+import sys
 
 __version__ = '0.2-git'
 
-from . import subexprs
-from . import optimization
-from . import generation
+__all__ = ['subexprs', 'optimization', 'generation', 'scheduling', 'autodiff', 'costmodel', 'strategy', 'pyxbuild', 'pybuild', 'cache', 'vecmath', 'runtime', 'incremental']
+
+
+def __getattr__(name):
+    if name in __all__:
+        return importlib.import_module('.' + name, __name__)
+    raise AttributeError('module ' + repr(__name__) + ' has no attribute ' + repr(name))
+
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
+
 
-__all__ = ['subexprs', 'optimization', 'generation']
+if sys.version_info < (3, 7):
+    for _name in __all__:
+        importlib.import_module('.' + _name, __name__)
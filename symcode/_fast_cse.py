@@ -5,9 +5,8 @@ from collections import OrderedDict
 from sympy.core import Basic, Mul, Add, sympify
 from sympy.core.basic import preorder_traversal
 from sympy.core.function import _coeff_isneg
-from sympy.core.compatibility import iterable
 from sympy.utilities.iterables import numbered_symbols, \
-    sift, topological_sort, ordered
+    sift, topological_sort, ordered, iterable
 
 from sympy.simplify import cse_opts
 
@@ -23,7 +22,7 @@ from sympy.simplify import cse_opts
 # ``None`` can be used to specify no transformation for either the preprocessor or
 # postprocessor.
 
-cse_optimizations = list(cse_opts.default_optimizations)
+cse_optimizations = list(getattr(cse_opts, 'default_optimizations', [(cse_opts.sub_pre, cse_opts.sub_post)]))
 
 # sometimes we want the output in a different format; non-trivial
 # transformations can be put here for users
@@ -297,10 +296,12 @@ def cse(exprs, symbols=None, optimizations=None, postprocess=None):
     
     # process adds - any adds that weren't repeated might contain
     # subpatterns that are repeated, e.g. x+y+z and x+y have x+y in common
+    # (the args sets keep the ivars of the extracted subpatterns, so later
+    # extractions from the same add do not drop them)
     adds = list(ordered(adds))
     addargs = [set(a.args) for a in adds]
-    for i in xrange(len(addargs)):
-        for j in xrange(i + 1, len(addargs)):
+    for i in range(len(addargs)):
+        for j in range(i + 1, len(addargs)):
             com = addargs[i].intersection(addargs[j])
             if len(com) > 1:
                 
@@ -327,10 +328,10 @@ def cse(exprs, symbols=None, optimizations=None, postprocess=None):
                     adds[j] = newadd
                 #else add_j is itself subexp_iv[add_subexp] -> ivar
                         
-                addargs[i] = diff_add_i
-                addargs[j] = diff_add_j
+                addargs[i] = diff_add_i | set([ivar]) if diff_add_i else diff_add_i
+                addargs[j] = diff_add_j | set([ivar]) if diff_add_j else diff_add_j
                 
-                for k in xrange(j + 1, len(addargs)):
+                for k in range(j + 1, len(addargs)):
                     if com.issubset(addargs[k]):
                         
                         diff_add_k = addargs[k].difference(com)
@@ -341,15 +342,15 @@ def cse(exprs, symbols=None, optimizations=None, postprocess=None):
                             adds[k] = newadd
                         #else add_k is itself subexp_iv[add_subexp] -> ivar
                         
-                        addargs[k] = diff_add_k
+                        addargs[k] = diff_add_k | set([ivar]) if diff_add_k else diff_add_k
 
     # process muls - any muls that weren't repeated might contain
     # subpatterns that are repeated, e.g. x*y*z and x*y have x*y in common
     # *assumes that there are no non-commutative parts*
     muls = list(ordered(muls))
     mulargs = [set(a.args) for a in muls]
-    for i in xrange(len(mulargs)):
-        for j in xrange(i + 1, len(mulargs)):
+    for i in range(len(mulargs)):
+        for j in range(i + 1, len(mulargs)):
             com = mulargs[i].intersection(mulargs[j])
             if len(com) > 1:
                 
@@ -376,10 +377,10 @@ def cse(exprs, symbols=None, optimizations=None, postprocess=None):
                     muls[j] = newmul
                 #else mul_j is itself subexp_iv[mul_subexp] -> ivar
                         
-                mulargs[i] = diff_mul_i
-                mulargs[j] = diff_mul_j
+                mulargs[i] = diff_mul_i | set([ivar]) if diff_mul_i else diff_mul_i
+                mulargs[j] = diff_mul_j | set([ivar]) if diff_mul_j else diff_mul_j
                 
-                for k in xrange(j + 1, len(mulargs)):
+                for k in range(j + 1, len(mulargs)):
                     if com.issubset(mulargs[k]):
                         
                         diff_mul_k = mulargs[k].difference(com)
@@ -390,11 +391,11 @@ def cse(exprs, symbols=None, optimizations=None, postprocess=None):
                             muls[k] = newmul
                         #else mul_k is itself subexp_iv[mul_subexp] -> ivar
                         
-                        mulargs[k] = diff_mul_k
+                        mulargs[k] = diff_mul_k | set([ivar]) if diff_mul_k else diff_mul_k
     
     # Find all of the repeated subexpressions.
     
-    ivar_se = {iv:se for se,iv in subexp_iv.iteritems()}
+    ivar_se = {iv:se for se,iv in subexp_iv.items()}
     
     used_ivs = set()
     repeated = set()
@@ -454,6 +455,6 @@ def cse(exprs, symbols=None, optimizations=None, postprocess=None):
     if isinstance(exprs, Matrix):
         out_exprs = Matrix(exprs.rows, exprs.cols, out_exprs)
     if postprocess is None:
-        return ordered_iv_se.items(), out_exprs
-    return postprocess(ordered_iv_se.items(), out_exprs)
+        return list(ordered_iv_se.items()), out_exprs
+    return postprocess(list(ordered_iv_se.items()), out_exprs)
 
@@ -0,0 +1,132 @@
+
+import sympy
+import sympy.utilities
+
+
+def _prune( subexprs, out_exprs ):
+    """Remove the subexpressions not (transitively) used by the output expressions."""
+
+    ivs_set = set(iv for iv, se in subexprs)
+    used = set()
+    for expr in out_exprs:
+        used |= sympy.sympify(expr).free_symbols & ivs_set
+
+    pruned = []
+    for iv, se in reversed(subexprs):
+        if iv in used:
+            used |= se.free_symbols & ivs_set
+            pruned.append((iv, se))
+    pruned.reverse()
+
+    return pruned, list(out_exprs)
+
+
+def forward_diff( code, wrt, dvarname='dx' ):
+    """Generate the code of the Jacobian of code outputs with respect to the 'wrt' symbols.
+
+    Forward mode automatic differentiation: a tangent of each subexpression
+    with respect to each 'wrt' symbol is computed right after it, reusing the
+    primal temporaries, and only non-trivial tangents get new 'dvarname'
+    temporaries.
+
+    Returns code whose outputs are the Jacobian entries in row-major order
+    (output index first).
+
+    """
+
+    wrt = list(wrt)
+    n = len(wrt)
+    dsymbols = sympy.utilities.iterables.numbered_symbols(dvarname, real=True)
+
+    tangents = {}
+    for j, w in enumerate(wrt):
+        tangents[w] = [sympy.S.One if k == j else sympy.S.Zero for k in range(n)]
+
+    def _tangent(expr, subexprs, materialize):
+        partials = []
+        for symb in sorted(expr.free_symbols, key=str):
+            if symb in tangents:
+                partial = expr.diff(symb)
+                if partial == 0: continue
+                used = sum(1 for t in tangents[symb] if t != 0)
+                if materialize and used > 1 and not partial.is_Atom:
+                    dsymb = next(dsymbols)
+                    subexprs.append((dsymb, partial))
+                    partial = dsymb
+                partials.append((partial, tangents[symb]))
+        tangent = []
+        for j in range(n):
+            dexpr = sympy.Add(*[partial*t[j] for partial, t in partials if t[j] != 0])
+            if materialize and not dexpr.is_Atom:
+                dsymb = next(dsymbols)
+                subexprs.append((dsymb, dexpr))
+                dexpr = dsymb
+            tangent.append(dexpr)
+        return tangent
+
+    subexprs = []
+    for iv, se in code[0]:
+        subexprs.append((iv, se))
+        tangent = _tangent(se, subexprs, True)
+        if any(t != 0 for t in tangent):
+            tangents[iv] = tangent
+
+    out_exprs = []
+    for expr in code[1]:
+        out_exprs += _tangent(sympy.sympify(expr), subexprs, False)
+
+    return _prune(subexprs, out_exprs)
+
+
+def reverse_diff( code, wrt, seeds=None, bvarname='bx' ):
+    """Generate the code of the gradient of code outputs with respect to the 'wrt' symbols.
+
+    Reverse (adjoint) mode automatic differentiation: the adjoints of the
+    subexpressions are accumulated sweeping the code backwards, reusing the
+    primal temporaries, and the non-trivial ones get new 'bvarname' temporaries.
+    With several outputs, the gradient of their sum weighted by 'seeds' is
+    generated.
+
+    Returns code whose outputs are the gradient entries.
+
+    """
+
+    wrt = list(wrt)
+    out_exprs = [sympy.sympify(expr) for expr in code[1]]
+
+    if seeds is None:
+        if len(out_exprs) != 1:
+            raise Exception('seeds must be given for code with more than one output.')
+        seeds = [1]
+
+    bsymbols = sympy.utilities.iterables.numbered_symbols(bvarname, real=True)
+
+    ivs_set = set(iv for iv, se in code[0])
+    active = ivs_set | set(wrt)
+
+    adjoints = {}
+
+    def _accumulate(expr, adjoint):
+        for symb in expr.free_symbols & active:
+            partial = expr.diff(symb)
+            if partial != 0:
+                adjoints.setdefault(symb, []).append(partial*adjoint)
+
+    for expr, seed in zip(out_exprs, seeds):
+        if seed != 0:
+            _accumulate(expr, sympy.sympify(seed))
+
+    adjoint_subexprs = []
+    for iv, se in reversed(code[0]):
+        if iv not in adjoints: continue
+        adjoint = sympy.Add(*adjoints.pop(iv))
+        if adjoint == 0: continue
+        if not adjoint.is_Atom:
+            bsymb = next(bsymbols)
+            adjoint_subexprs.append((bsymb, adjoint))
+            adjoint = bsymb
+        _accumulate(se, adjoint)
+
+    gradient = [sympy.Add(*adjoints.get(w, [])) for w in wrt]
+
+    return _prune(list(code[0]) + adjoint_subexprs, gradient)
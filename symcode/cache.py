@@ -0,0 +1,192 @@
+
+import functools
+import hashlib
+import os
+import pickle
+import sympy
+
+from . import __version__
+from . import subexprs
+from . import generation
+
+
+default_cache_dir = os.path.join(os.path.expanduser('~'), '.cache', 'symcode', 'codegen')
+
+generators = {}
+generators['c'] = generation.gen_c_func
+generators['python'] = generation.gen_py_func
+generators['py'] = generation.gen_py_func
+generators['pyfast'] = generation.gen_py_fast_func
+generators['cython'] = generation.gen_pyx_func
+generators['pyx'] = generation.gen_pyx_func
+
+
+def _code_repr(code):
+    """Representation of a function code object (bytecode, constants and referenced names)."""
+
+    consts = [_code_repr(c) if hasattr(c, 'co_code') else _option_repr(c) for c in code.co_consts]
+    return repr(code.co_code) + ', (' + ', '.join(consts) + '), ' + repr(code.co_names)
+
+
+def _option_repr(option, _seen=()):
+    """Stable representation of an option value.
+
+    Functions are represented by their qualified name and, for Python
+    functions, by their code, defaults and closure cell values, so distinct
+    lambdas or closures defined at the same place get distinct
+    representations; functools.partial objects by their function, arguments
+    and keywords.
+
+    """
+
+    if isinstance(option, functools.partial):
+        return 'partial(' + _option_repr(option.func, _seen) + ', ' + _option_repr(option.args, _seen) + \
+            ', ' + _option_repr(option.keywords or {}, _seen) + ')'
+    elif callable(option) and hasattr(option, '__name__'):
+        name = getattr(option, '__module__', '') + '.' + getattr(option, '__qualname__', option.__name__)
+        code = getattr(option, '__code__', None)
+        if code is None or id(option) in _seen:
+            return name
+        _seen = _seen + (id(option),)
+        cells = []
+        for cell in getattr(option, '__closure__', None) or ():
+            try:
+                cells.append(_option_repr(cell.cell_contents, _seen))
+            except ValueError: # empty cell
+                cells.append('<empty>')
+        return name + '[' + _code_repr(code) + ', ' + _option_repr(option.__defaults__ or (), _seen) + \
+            ', ' + _option_repr(getattr(option, '__kwdefaults__', None) or {}, _seen) + ', (' + ', '.join(cells) + ')]'
+    elif isinstance(option, (list, tuple)):
+        return '(' + ', '.join(_option_repr(o, _seen) for o in option) + ')'
+    elif isinstance(option, dict):
+        return '{' + ', '.join(repr(k) + ': ' + _option_repr(option[k], _seen) for k in sorted(option)) + '}'
+    elif isinstance(option, (set, frozenset)):
+        return '{' + ', '.join(sorted(_option_repr(o, _seen) for o in option)) + '}'
+    elif isinstance(option, sympy.Basic):
+        return sympy.srepr(option)
+    else:
+        return repr(option)
+
+
+class CodegenCache(object):
+    """On-disk content addressed store of generated code.
+
+    Entries (code, source) are stored in 'cache_dir' (by default
+    ~/.cache/symcode/codegen) under a hash of the input expressions srepr and
+    of all the options, and the least recently used ones are evicted when
+    the store exceeds 'max_size' bytes. 'stats' counts the hits, misses,
+    stores and evictions.
+
+    """
+
+    def __init__(self, cache_dir=None, max_size=256*2**20):
+
+        if cache_dir is None:
+            cache_dir = default_cache_dir
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    def key(self, exprs, **options):
+        """Hash of the expressions srepr, the options and the symcode version."""
+
+        if isinstance(exprs, sympy.Basic) and not isinstance(exprs, sympy.MatrixBase):
+            exprs = [exprs]
+
+        key = hashlib.sha1()
+        for expr in exprs:
+            key.update(sympy.srepr(expr).encode('utf-8'))
+            key.update(b'\n')
+        key.update(_option_repr(options).encode('utf-8'))
+        key.update(__version__.encode('utf-8'))
+
+        return key.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key + '.pickle')
+
+    def get(self, key):
+        """Return the stored (code, source) of key, or None."""
+
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                entry = pickle.load(f)
+        except Exception:
+            self.stats['misses'] += 1
+            return None
+
+        os.utime(path, None) # mark as recently used
+        self.stats['hits'] += 1
+        return entry
+
+    def put(self, key, code, source):
+        """Store (code, source) under key, evicting least recently used entries over max_size."""
+
+        path = self._path(key)
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump((code, source), f, 2)
+        os.rename(path + '.tmp', path)
+        self.stats['stores'] += 1
+
+        self._evict()
+
+    def _evict(self):
+
+        entries = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.pickle'):
+                st = os.stat(os.path.join(self.cache_dir, name))
+                entries.append((st.st_mtime, st.st_size, name))
+                total += st.st_size
+
+        entries.sort()
+        for mtime, size, name in entries[:-1]:
+            if total <= self.max_size:
+                break
+            os.remove(os.path.join(self.cache_dir, name))
+            total -= size
+            self.stats['evictions'] += 1
+
+    def clear(self):
+        """Remove all entries."""
+
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.pickle'):
+                os.remove(os.path.join(self.cache_dir, name))
+
+    def generate(self, exprs, func_parms, func_name='func', lang='c', outvar_name='out',
+                 subexprs_options=None, passes=()):
+        """Collect, optimize and generate the code of exprs, or return it from the store.
+
+        The expressions are collected with Subexprs(**subexprs_options), the
+        'passes' (functions of code, e.g. optimization.copy_propag) are applied
+        in order, and the source is generated with generators[lang]. Passes
+        and optimizations are identified by their qualified names.
+
+        Returns (code, source).
+
+        """
+
+        subexprs_options = dict(subexprs_options or {})
+        passes = list(passes)
+
+        key = self.key(exprs, func_parms=list(func_parms), func_name=func_name, lang=lang,
+                       outvar_name=outvar_name, subexprs_options=subexprs_options, passes=passes)
+
+        entry = self.get(key)
+        if entry is not None:
+            return entry
+
+        se = subexprs.Subexprs(**subexprs_options)
+        code = se.get(se.collect(exprs))
+        for codepass in passes:
+            code = codepass(code)
+        source = generators[lang.lower()](code, func_parms, func_name, outvar_name)
+
+        self.put(key, code, source)
+        return code, source
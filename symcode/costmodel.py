@@ -0,0 +1,76 @@
+
+import sympy
+
+
+default_costs = {}
+default_costs['add'] = 1
+default_costs['mul'] = 1
+default_costs['div'] = 4
+default_costs['sqrt'] = 8
+default_costs['pow'] = 20
+default_costs['function'] = 20
+
+
+class CostModel(object):
+    """Estimated evaluation cost of expressions and code.
+
+    'costs' updates the default operation costs: 'add', 'mul', 'div', 'sqrt',
+    'pow', 'function' (any function call) or a function name (e.g. 'sin').
+    'tmp_cost' is the cost of storing and loading a temporary, and nodes whose
+    own operation costs at least 'materialize_cost' (by default, function calls
+    and non trivial powers) are always extracted to temporaries.
+
+    """
+
+    def __init__(self, costs=None, tmp_cost=1, materialize_cost=20):
+        self.costs = dict(default_costs)
+        if costs:
+            self.costs.update(costs)
+        self.tmp_cost = tmp_cost
+        self.materialize_cost = materialize_cost
+
+    def node_cost(self, expr):
+        """Cost of the top operation of expr (arguments assumed already computed)."""
+
+        costs = self.costs
+
+        if expr.is_Atom:
+            return 0
+        elif expr.is_Add:
+            return (len(expr.args) - 1) * costs['add']
+        elif expr.is_Mul:
+            return (len(expr.args) - 1) * costs['mul']
+        elif expr.is_Pow:
+            exp = expr.exp
+            if exp == 2:
+                return costs['mul']
+            elif exp == -1:
+                return costs['div']
+            elif exp == sympy.S.Half:
+                return costs['sqrt']
+            elif exp.is_Number and exp < 0:
+                return costs['pow'] + costs['div']
+            else:
+                return costs['pow']
+        elif expr.is_Function:
+            return costs.get(type(expr).__name__, costs['function'])
+        else:
+            return costs['add']
+
+    def __call__(self, expr):
+        """Cost of the whole expression tree."""
+
+        expr = sympy.sympify(expr)
+        if expr.is_Atom:
+            return 0
+        return self.node_cost(expr) + sum(self(arg) for arg in expr.args)
+
+    def code_cost(self, code):
+        """Cost of code, including the temporaries cost."""
+
+        cost = 0
+        for iv, se in code[0]:
+            cost += self(se) + self.tmp_cost
+        for expr in code[1]:
+            cost += self(expr)
+        return cost
@@ -1,11 +1,15 @@
 
-import copy
+import math
 import string
 import sympy
+import sympy.printing.str
+import sympy.printing.precedence
 import sys
 import re
 
 from . import optimization
+from . import scheduling
+from . import vecmath
 
 options = {}
 options['unroll_square'] = True
@@ -13,22 +17,8 @@ options['unroll_square'] = True
 
 def code_back_to_exprs(code):
     
-    ivars = copy.deepcopy(code[0])
-    exps = copy.deepcopy(code[1])
-    
-    for i in range(len(ivars)):
-        
-        Dxreplace = { ivars[i][0] : ivars[i][1] }
-        
-        for j in range(i+1,len(ivars)):
-                if ivars[j][1].has(ivars[i][0]):
-                    ivars[j] = ( ivars[j][0], ivars[j][1].xreplace( Dxreplace ) )
-        
-        for j in range(len(exps)):
-                if sympy.sympify(exps[j]).has(ivars[i][0]):
-                    exps[j] = exps[j].xreplace( Dxreplace )
-    
-    return exps
+    # inline all the subexpressions (see optimization.substitute)
+    return optimization.substitute( code, dict(code[0]) )[1]
 
 def _ccode( expr, ):
   code = sympy.ccode( expr )
@@ -37,21 +27,155 @@ def _ccode( expr, ):
   else:
     return code
   
-def code_to_string( code, outvar_name='out', indent='', realtype='', line_end='' ):
+_c_math_funcs = ['sin', 'cos', 'tan', 'asin', 'acos', 'atan', 'atan2', 'sinh', 'cosh', 'tanh',
+                 'asinh', 'acosh', 'atanh', 'exp', 'exp2', 'expm1', 'log', 'log10', 'log2', 'log1p',
+                 'sqrt', 'cbrt', 'pow', 'fabs', 'floor', 'ceil', 'erf', 'erfc', 'tgamma', 'lgamma', 'hypot']
+
+def _typed_literals( codestr, ctype, lang='c' ):
+  """Type the floating point literals, constants and math functions of printed code as ctype ('float' or 'double')."""
+  literal = r'(?<![\w.])(\d+\.\d*(?:[eE][-+]?\d+)?)'
+  codestr = re.sub(literal + 'L', r'\1', codestr)
+  if ctype == 'float':
+    if lang == 'c':
+      codestr = re.sub(literal + r'(?![\w.])', r'\1f', codestr)
+      codestr = re.sub(r'\b(M_\w+)\b', r'((float)\1)', codestr)
+    else:
+      codestr = re.sub(literal + r'(?![\w.])', r'(<float>\1)', codestr)
+      codestr = re.sub(r'\b(M_\w+)\b', r'(<float>\1)', codestr)
+    codestr = re.sub(r'\b(' + '|'.join(_c_math_funcs) + r')\(', r'\1f(', codestr)
+  return codestr
+
+def _storage_type( precision ):
+  if precision in [None, 'double']:
+    return 'double'
+  elif precision in ['float', 'mixed']:
+    return 'float'
+  else:
+    raise Exception('precision must be float, double or mixed.')
+
+def _item_types( code, precision, double_outputs=None ):
+  """Type of each code item (assignments then outputs) for the given precision.
+
+  In 'mixed' precision, the 'double_outputs' (by default all outputs) and the
+  temporaries they depend on are computed in double, the rest in float.
+
+  """
+  _storage_type( precision )
+  nivs = len(code[0])
+  if precision != 'mixed':
+    return [_storage_type( precision )]*(nivs + len(code[1]))
+  if double_outputs is None:
+    double_outputs = range(len(code[1]))
+  double_outputs = set(double_outputs)
+  deps = scheduling.code_dependencies( code )
+  types = ['float']*(nivs + len(code[1]))
+  for i in reversed(range(len(types))):
+    if (i >= nivs and i - nivs in double_outputs) or (i < nivs and types[i] == 'double'):
+      types[i] = 'double'
+      for j in deps[i]:
+        types[j] = 'double'
+  return types
+
+def code_to_string( code, outvar_name='out', indent='', realtype='', line_end='', precision=None, double_outputs=None, lang='c' ):
     
     codestr = ''
     
     if realtype: realtype += ' '
     
-    for i in range( len(code[0]) ) :
-        codestr += indent + realtype + sympy.ccode( code[0][i][0] ) + ' = ' + _ccode( code[0][i][1] ) + line_end + '\n'
+    if precision is None:
+        
+        for i in range( len(code[0]) ) :
+            codestr += indent + realtype + sympy.ccode( code[0][i][0] ) + ' = ' + _ccode( code[0][i][1] ) + line_end + '\n'
+        
+        codestr += '\n'
+        for i in range( len(code[1]) ) :
+            codestr += indent + outvar_name + '['+str(i)+'] = ' + _ccode( code[1][i] ) + line_end + '\n'
+        
+        return codestr
+    
+    # precision typed temporaries, literals and math functions
+    types = _item_types( code, precision, double_outputs )
+    nivs = len(code[0])
+    
+    for i in range( nivs ) :
+        codestr += indent + realtype.replace('double', types[i]) + sympy.ccode( code[0][i][0] ) + ' = ' + \
+                   _typed_literals( _ccode( code[0][i][1] ), types[i], lang ) + line_end + '\n'
     
     codestr += '\n'
     for i in range( len(code[1]) ) :
-        codestr += indent + outvar_name + '['+str(i)+'] = ' + _ccode( code[1][i] ) + line_end + '\n'
+        codestr += indent + outvar_name + '['+str(i)+'] = ' + _typed_literals( _ccode( code[1][i] ), types[nivs+i], lang ) + line_end + '\n'
     
     return codestr
 
+def constants_to_string( constants, lang='c', precision=None ):
+    """Definitions of the pooled constants (see optimization.constant_pool).
+
+    Values are rounded once to the literal of the chosen precision, emitted
+    as static const (C) or module level assignments ('py').
+
+    """
+
+    codestr = ''
+    ctype = 'float' if precision == 'float' else 'double'
+
+    for symbol, value in constants:
+        literal = repr(float(value))
+        if lang == 'c':
+            if ctype == 'float': literal += 'f'
+            codestr += 'static const ' + ctype + ' ' + sympy.ccode( symbol ) + ' = ' + literal + ';\n'
+        else:
+            codestr += str( symbol ) + ' = ' + literal + '\n'
+
+    return codestr
+
+def _profiled_code_string( code, sections, outvar_name, indent, realtype, line_end, counters_name, timer, comment,
+                           precision=None, double_outputs=None, lang='c' ):
+    """Code string of the code items by section (see scheduling.profile_sections).
+
+    Each section is followed by the accumulation, into counters_name[k], of
+    the 'timer' difference since the previous section (starting at _t0).
+
+    """
+
+    codestr = ''
+    sep = (line_end or ';') + ' '
+    types = _item_types( code, precision, double_outputs ) if precision is not None else None
+    n = len(code[0])
+
+    for k, section in enumerate(sections):
+        codestr += indent + comment + ' section ' + str(k) + '\n'
+        for i in section['items']:
+            if i < n:
+                left = (realtype.replace('double', types[i]) if types else realtype) + sympy.ccode( code[0][i][0] )
+                expr = code[0][i][1]
+            else:
+                left = outvar_name + '[' + str(i - n) + ']'
+                expr = code[1][i - n]
+            exprstr = _ccode( expr )
+            if types:
+                exprstr = _typed_literals( exprstr, types[i], lang )
+            codestr += indent + left + ' = ' + exprstr + line_end + '\n'
+        codestr += indent + '_t1 = ' + timer + sep + counters_name + '[' + str(k) + '] += _t1 - _t0' + sep + '_t0 = _t1' + line_end + '\n'
+
+    return codestr
+
+_c_profile_timer = '''#ifndef SYMCODE_PROFILE_NOW
+#if defined(__x86_64__) || defined(__i386__)
+#include <x86intrin.h>
+#define SYMCODE_PROFILE_NOW() __rdtsc()
+#else
+#include <time.h>
+static inline unsigned long long symcode_profile_now( void )
+{
+  struct timespec t;
+  clock_gettime(CLOCK_MONOTONIC, &t);
+  return t.tv_sec*1000000000ULL + t.tv_nsec;
+}
+#define SYMCODE_PROFILE_NOW() symcode_profile_now()
+#endif
+#endif
+'''
+
 def codestring_count( codestring, resume=False ):
   ops = []
   ops += [( '=' , int(codestring.count('=')) )]
@@ -70,10 +194,25 @@ def codestring_count( codestring, resume=False ):
     return ops, {'add':adds, 'mul':muls, 'total':adds+muls }
 
 
-def gen_py_func( code, func_parms, func_name='func', outvar_name='out' ):
+def gen_py_func( code, func_parms, func_name='func', outvar_name='out', constants=None, profile=None ):
+    """Generate a Python function computing code.
+
+    With 'profile' (sections, see scheduling.profile_sections), the time
+    spent in each section is accumulated into the module level list
+    <func_name>_profile, and (python code string, sections) is returned.
+
+    """
 
     indent = 4*' '
 
+    # module level definitions, kept out of the blank line replacement below
+    header = ''
+    if constants:
+        header += constants_to_string( constants, 'py' ) + '\n'
+    if profile is not None:
+        sections = scheduling.profile_sections( code, profile )
+        header += 'import time as _time\n' + func_name + '_profile = [0.0]*' + str(len(sections)) + '\n\n'
+
     pycode = 'def ' + func_name + '('
     if func_parms:
         pycode += ' ' + func_parms[0]
@@ -84,48 +223,595 @@ def gen_py_func( code, func_parms, func_name='func', outvar_name='out' ):
 
     pycode += indent + outvar_name + ' = [0]*' + str( len(code[1]) ) + '\n\n'
 
-    mainpycode = code_to_string( code, outvar_name, indent )
+    if profile is None:
+        mainpycode = code_to_string( code, outvar_name, indent )
+    else:
+        mainpycode = indent + '_t0 = _time.perf_counter()\n' + \
+                     _profiled_code_string( code, sections, outvar_name, indent, '', '', func_name + '_profile',
+                                            '_time.perf_counter()', '#' )
     
     pycode += mainpycode
 
     pycode += '\n' + indent + 'return ' + outvar_name
     
-    pycode = pycode.replace('\n\n','\n#\n')
+    pycode = header + pycode.replace('\n\n','\n#\n')
     
+    if profile is None:
+        return pycode
+    return pycode, sections
+
+class _PyPrinter(sympy.printing.str.StrPrinter):
+    """Python expression printer: float rational literals, squares as products."""
+
+    def _print_Rational(self, expr):
+        return repr(float(expr.p) / float(expr.q))
+
+    def _print_Pow(self, expr, rational=False):
+        if expr.exp == 2:
+            base = self.parenthesize(expr.base, sympy.printing.precedence.PRECEDENCE['Mul'])
+            return '(' + base + '*' + base + ')'
+        return super(_PyPrinter, self)._print_Pow(expr, rational)
+
+_py_constants = [(sympy.pi, 'pi'), (sympy.E, 'E')]
+_py_math_names = {'Abs': 'fabs', 'E': 'e'}
+
+
+def gen_py_fast_func( code, func_parms, func_name='func', outvar_name='out', constants=None ):
+    """Generate a Python function writing into a caller supplied output buffer.
+
+    The function is called as func(out, parms...) with 'out' a buffer (list
+    or array.array) of len(code[1]) items, and returns it. Unlike gen_py_func,
+    valid Python is printed, and the used math module functions and constants
+    are bound as default argument locals, as are the pooled 'constants' (see
+    optimization.constant_pool) defined at module level.
+
+    """
+
+    indent = 4*' '
+    printer = _PyPrinter()
+
+    names = set()
+    for expr in [se for iv, se in code[0]] + list(code[1]):
+        expr = sympy.sympify(expr)
+        for func in expr.atoms(sympy.Function):
+            name = type(func).__name__
+            if not hasattr(math, _py_math_names.get(name, name)):
+                raise Exception('function ' + name + ' not supported by the Python backend.')
+            names.add(name)
+        for const, name in _py_constants:
+            if expr.has(const):
+                names.add(name)
+        if any(abs(pow.exp) == sympy.S.Half for pow in expr.atoms(sympy.Pow)):
+            names.add('sqrt')
+
+    pycode = 'import math as _math\n\n'
+    if constants:
+        pycode += constants_to_string( constants, 'py' )
+    pycode += '\n\n'
+    pycode += 'def ' + func_name + '( ' + outvar_name
+    for parm in func_parms :
+        pycode += ', ' + parm
+    for name in sorted(names):
+        pycode += ', ' + name + '=_math.' + _py_math_names.get(name, name)
+    for symbol, value in constants or []:
+        pycode += ', ' + str(symbol) + '=' + str(symbol)
+    pycode += ' ):\n'
+
+    for iv, se in code[0]:
+        pycode += indent + printer.doprint(iv) + ' = ' + printer.doprint(se) + '\n'
+    for i, expr in enumerate(code[1]):
+        pycode += indent + outvar_name + '[' + str(i) + '] = ' + printer.doprint(sympy.sympify(expr)) + '\n'
+
+    pycode += indent + 'return ' + outvar_name + '\n'
+
     return pycode
 
-def gen_c_func( code, func_parms, func_name='func', outvar_name='out' ):
+def gen_c_func( code, func_parms, func_name='func', outvar_name='out', precision=None, double_outputs=None, constants=None, profile=None ):
+    """Generate a C function computing code.
+
+    With 'precision' ('double', 'float' or 'mixed'), the literals, math
+    functions and temporaries are typed accordingly (no long double
+    literals); 'mixed' stores arguments and outputs as float but computes the
+    'double_outputs' (by default all) and their temporaries in double.
+    The pooled 'constants' (see optimization.constant_pool) are defined
+    before the function.
+
+    With 'profile' (sections, see scheduling.profile_sections), the cycles
+    (rdtsc, or nanoseconds elsewhere) spent in each section are accumulated
+    into the exported array <func_name>_profile and the calls counted in
+    <func_name>_profile_calls, and (c code string, sections) is returned.
+    Counts are approximate as the compiler may move computations across
+    section boundaries.
+
+    """
     
     indent = 2*' '
+    storage = _storage_type( precision )
 
-    ccode = 'void ' + func_name + '( double* ' + outvar_name
+    # file level definitions, kept out of the blank line replacement below
+    header = ''
+    if constants:
+        header += constants_to_string( constants, 'c', precision ) + '\n'
+    if profile is not None:
+        sections = scheduling.profile_sections( code, profile )
+        header += _c_profile_timer + '\nunsigned long long ' + func_name + '_profile[' + str(len(sections)) + '];\n' + \
+                 'unsigned long long ' + func_name + '_profile_calls;\n\n'
+
+    ccode = 'void ' + func_name + '( ' + storage + '* ' + outvar_name
     for parm in func_parms :
-        ccode += ', const double* ' + parm
+        ccode += ', const ' + storage + '* ' + parm
     ccode += ' )\n{\n'
     
-    mainccode = code_to_string( code, outvar_name, indent, 'double', ';' )
+    if profile is None:
+        mainccode = code_to_string( code, outvar_name, indent, 'double', ';', precision, double_outputs )
+    else:
+        mainccode = indent + 'unsigned long long _t0 = SYMCODE_PROFILE_NOW(), _t1;\n' + \
+                    indent + func_name + '_profile_calls++;\n' + \
+                    _profiled_code_string( code, sections, outvar_name, indent, 'double ', ';', func_name + '_profile',
+                                           'SYMCODE_PROFILE_NOW()', '//', precision, double_outputs )
 
     ccode += mainccode + '\n'+indent+'return;\n}'
     
-    ccode = ccode.replace('\n\n','\n//\n')
+    ccode = header + ccode.replace('\n\n','\n//\n')
     
+    if profile is None:
+        return ccode
+    return ccode, sections
+
+def _simd_rewrite( expr, prefix ):
+    """Replace the vector valued functions and powers of expr by the vecmath functions."""
+
+    if expr.is_Atom or not expr.free_symbols:
+        return expr
+
+    args = [_simd_rewrite( arg, prefix ) for arg in expr.args]
+    zero = sympy.Symbol(prefix + '_ZERO')
+    vargs = [arg if arg.free_symbols else arg + zero for arg in args]
+
+    if expr.is_Pow:
+        base, exp = args
+        if exp == -1:
+            return sympy.Pow(base, exp)
+        elif exp == sympy.S.Half:
+            return sympy.Function(prefix + '_sqrt')(base)
+        elif exp == -sympy.S.Half:
+            return 1/sympy.Function(prefix + '_sqrt')(base)
+        elif exp.is_Integer:
+            return sympy.Function(prefix + '_powi')(base, exp)
+        else:
+            return sympy.Function(prefix + '_pow')(*vargs)
+    elif expr.is_Function:
+        name = _py_math_names.get(type(expr).__name__, type(expr).__name__)
+        if name not in vecmath.poly_funcs and name not in dict(vecmath.lanewise_funcs):
+            raise Exception('function ' + name + ' not supported by the SIMD backend.')
+        return sympy.Function(prefix + '_' + name)(*vargs)
+
+    return expr.func(*args)
+
+def gen_c_simd_func( code, func_parms, func_name='func', outvar_name='out', width=4, precision='double', prelude=True ):
+    """Generate a C function computing code for 'width' points at once with vector extension types.
+
+    The arguments and outputs are arrays of vectors (e.g. v4d_t for 4 doubles)
+    whose lanes are the points, so out[i] lane j is output i of the point
+    whose parameter values are the lanes j of the parameter items.
+    Transcendental functions use the vectorized implementations of vecmath,
+    whose definitions are prepended with 'prelude' (see vecmath.c_prelude).
+    'precision' is 'double' or 'float'.
+
+    """
+
+    if precision not in ['double', 'float']:
+        raise Exception('precision must be float or double.')
+    prefix = vecmath.prefix( width, precision )
+    vtype = prefix + '_t'
+    functions = [prefix + '_' + name for name in vecmath.poly_funcs + ['powi']] + \
+                [prefix + '_' + name for name, nargs in vecmath.lanewise_funcs]
+    user_functions = dict((name, name) for name in functions)
+
+    def _print(expr):
+        expr = sympy.sympify(expr)
+        if not expr.free_symbols:
+            expr = expr + sympy.Symbol(prefix + '_ZERO')
+        expr = _simd_rewrite( expr, prefix )
+        return _typed_literals( sympy.ccode( expr, user_functions=user_functions ), precision )
+
+    indent = 2*' '
+
+    ccode = ''
+    if prelude:
+        ccode += _typed_literals( vecmath.c_prelude( width, precision ), precision ) + '\n'
+
+    ccode += 'void ' + func_name + '( ' + vtype + '* ' + outvar_name
+    for parm in func_parms :
+        ccode += ', const ' + vtype + '* ' + parm
+    ccode += ' )\n{\n'
+
+    for iv, se in code[0]:
+        ccode += indent + vtype + ' ' + sympy.ccode( iv ) + ' = ' + _print( se ) + ';\n'
+    ccode += '//\n'
+    for i, expr in enumerate(code[1]):
+        ccode += indent + outvar_name + '[' + str(i) + '] = ' + _print( expr ) + ';\n'
+
+    ccode += '//\n' + indent + 'return;\n}'
+
     return ccode
 
-def gen_pyx_func( code, func_parms, func_name='func', outvar_name='out' ):
+def gen_pyx_func( code, func_parms, func_name='func', outvar_name='out', precision=None, double_outputs=None ):
 
     indent = 4*' '
+    storage = _storage_type( precision )
 
-    ccode = 'cdef void ' + func_name + '( double* ' + outvar_name
+    ccode = 'cdef void ' + func_name + '( ' + storage + '* ' + outvar_name
     for parm in func_parms :
-        ccode += ', double* ' + parm
+        ccode += ', ' + storage + '* ' + parm
     ccode += ' ):\n'
         
-    mainccode = code_to_string( code, outvar_name, indent, 'cdef double' )
+    mainccode = code_to_string( code, outvar_name, indent, 'cdef double', '', precision, double_outputs, 'pyx' )
 
     ccode += mainccode + '\n'+indent+'return'
     return ccode
 
 
+def _parm_lengths( code, func_parms ):
+    """Minimum length of each parameter buffer, from the highest 'parm[i]' symbol read by code."""
+    lens = dict((parm, 0) for parm in func_parms)
+    exprs = [se for iv, se in code[0]] + list(code[1])
+    for expr in exprs:
+        for symbol in sympy.sympify(expr).free_symbols:
+            match = re.match(r'^(\w+)\[(\d+)\]$', symbol.name)
+            if match and match.group(1) in lens:
+                lens[match.group(1)] = max(lens[match.group(1)], int(match.group(2)) + 1)
+    return [lens[parm] for parm in func_parms]
+
+def gen_pyx_module( code, func_parms, func_name='func', outvar_name='out', batch=False, precision=None, double_outputs=None ):
+    """Generate a Cython module with a nogil kernel and Python callable wrappers.
+
+    The '<func_name>_kernel' cdef function is the gen_pyx_func code declared
+    'noexcept nogil'; the 'func_name' def function calls it, with the GIL
+    released, over typed memoryviews of the output and parameter buffers.
+    With 'batch', a '<func_name>_batch' def function evaluates a batch of
+    points, given as the rows of 2D output and parameter buffers, in a
+    parallel prange loop (the module must then be built with OpenMP, see
+    pyxbuild.build_pyx). 'precision' and 'double_outputs' are as in gen_c_func.
+    As the module is compiled without bounds checking, the wrappers raise
+    ValueError before calling the kernel if a buffer is shorter than the
+    indices the code uses (or, in batch, if the row counts differ).
+
+    """
+
+    indent = 4*' '
+    storage = _storage_type( precision )
+
+    pyxcode = '# cython: boundscheck=False, wraparound=False, cdivision=True\n\n'
+    pyxcode += 'from libc.math cimport *\n'
+    if batch:
+        pyxcode += 'from cython.parallel cimport prange\n'
+    pyxcode += '\n\n'
+
+    pyxcode += 'cdef inline void ' + func_name + '_kernel( ' + storage + '* ' + outvar_name
+    for parm in func_parms :
+        pyxcode += ', const ' + storage + '* ' + parm
+    pyxcode += ' ) noexcept nogil:\n'
+    pyxcode += code_to_string( code, outvar_name, indent, 'cdef double', '', precision, double_outputs, 'pyx' )
+    pyxcode += '\n\n'
+
+    lens = [(outvar_name, len(code[1]))] + list(zip(func_parms, _parm_lengths( code, func_parms )))
+
+    pyxcode += 'def ' + func_name + '( ' + storage + '[::1] ' + outvar_name
+    for parm in func_parms :
+        pyxcode += ', const ' + storage + '[::1] ' + parm
+    pyxcode += ' ):\n'
+    for name, n in lens:
+        if n:
+            pyxcode += indent + 'if ' + name + '.shape[0] < ' + str(n) + ':\n'
+            pyxcode += 2*indent + 'raise ValueError(\'' + name + ' must have at least ' + str(n) + ' items.\')\n'
+    pyxcode += indent + 'with nogil:\n'
+    pyxcode += 2*indent + func_name + '_kernel( &' + outvar_name + '[0]'
+    for parm in func_parms :
+        pyxcode += ', &' + parm + '[0]'
+    pyxcode += ' )\n'
+
+    if batch:
+        pyxcode += '\n\n'
+        pyxcode += 'def ' + func_name + '_batch( ' + storage + '[:, ::1] ' + outvar_name
+        for parm in func_parms :
+            pyxcode += ', const ' + storage + '[:, ::1] ' + parm
+        pyxcode += ' ):\n'
+        for name, n in lens:
+            if name != outvar_name:
+                pyxcode += indent + 'if ' + name + '.shape[0] != ' + outvar_name + '.shape[0]:\n'
+                pyxcode += 2*indent + 'raise ValueError(\'' + name + ' must have as many rows as ' + outvar_name + '.\')\n'
+            if n:
+                pyxcode += indent + 'if ' + name + '.shape[1] < ' + str(n) + ':\n'
+                pyxcode += 2*indent + 'raise ValueError(\'' + name + ' rows must have at least ' + str(n) + ' items.\')\n'
+        pyxcode += indent + 'cdef Py_ssize_t i\n'
+        pyxcode += indent + 'for i in prange(' + outvar_name + '.shape[0], nogil=True, schedule=\'static\'):\n'
+        pyxcode += 2*indent + func_name + '_kernel( &' + outvar_name + '[i, 0]'
+        for parm in func_parms :
+            pyxcode += ', &' + parm + '[i, 0]'
+        pyxcode += ' )\n'
+
+    return pyxcode
+
+
+def _split_groups( se, groups, ctx_name ):
+    if hasattr(groups, 'items'):
+        groups = list(groups.items())
+    names = [name for name, exprs in groups]
+    exprs = []
+    group_lens = []
+    for name, group_exprs in groups:
+        if isinstance(group_exprs, sympy.Basic) and not isinstance(group_exprs, sympy.MatrixBase):
+            group_exprs = [group_exprs]
+        group_exprs = list(group_exprs)
+        exprs += group_exprs
+        group_lens.append(len(group_exprs))
+    code = se.get(exprs)
+    core_code, groups_code = optimization.split_shared_code(code, group_lens, ctx_name)
+    return core_code, list(zip(names, groups_code))
+
+
+def gen_c_funcs( se, groups, func_parms, core_name='core', ctx_name='ctx', outvar_name='out' ):
+    """Generate C functions for several named output groups sharing a common core.
+
+    'groups' is a list of (name, collected expressions) pairs (or an ordered dict)
+    whose expressions were collected with the Subexprs instance 'se'.
+    The core function computes the shared subexpressions into a 'ctx_name' buffer
+    of <CORE_NAME>_CTX_LEN doubles, which each group function then reads.
+
+    """
+
+    core_code, groups_code = _split_groups( se, groups, ctx_name )
+
+    ccode = '#define ' + core_name.upper() + '_CTX_LEN ' + str( len(core_code[1]) ) + '\n\n'
+    ccode += gen_c_func( core_code, func_parms, core_name, ctx_name )
+    for name, group_code in groups_code:
+        ccode += '\n\n' + gen_c_func( group_code, [ctx_name] + list(func_parms), name, outvar_name )
+
+    return ccode
+
+def gen_py_funcs( se, groups, func_parms, core_name='core', ctx_name='ctx', outvar_name='out' ):
+    """Generate Python functions for several named output groups sharing a common core.
+
+    See gen_c_funcs; here the core function returns the 'ctx_name' list which is
+    passed as first argument to each group function.
+
+    """
+
+    core_code, groups_code = _split_groups( se, groups, ctx_name )
+
+    pycode = gen_py_func( core_code, func_parms, core_name, ctx_name )
+    for name, group_code in groups_code:
+        pycode += '\n\n' + gen_py_func( group_code, [ctx_name] + list(func_parms), name, outvar_name )
+
+    return pycode
+
+
+def gen_c_staged_funcs( code, input_groups, func_parms, func_name='func', outvar_name='out', cache_name='cache' ):
+    """Generate one C function per input group stage (see optimization.stage_code).
+
+    'func_parms' holds the list of function parameters of each input group.
+    Stage k function '<func_name>_stage<k>' fills the 'cache_name<k>' buffer of
+    <FUNC_NAME>_CACHE<k>_LEN doubles (the last stage fills the output) from the
+    caches of the previous stages and the parameters of stages 0 to k, so only
+    the stages whose inputs changed, and the ones after them, need to be rerun.
+
+    """
+
+    stages_code = optimization.stage_code( code, input_groups, cache_name )
+    last = len(stages_code) - 1
+
+    ccode = ''
+    for k in range(last):
+        ccode += '#define ' + func_name.upper() + '_CACHE' + str(k) + '_LEN ' + str( len(stages_code[k][1]) ) + '\n'
+
+    parms = []
+    for k, stage_code in enumerate(stages_code):
+        caches = [cache_name + str(j) for j in range(k)]
+        parms += list(func_parms[k])
+        outvar = outvar_name if k == last else cache_name + str(k)
+        ccode += '\n' + gen_c_func( stage_code, caches + parms, func_name + '_stage' + str(k), outvar ) + '\n'
+
+    return ccode
+
+def gen_py_staged_funcs( code, input_groups, func_parms, func_name='func', outvar_name='out', cache_name='cache' ):
+    """Generate one Python function per input group stage (see gen_c_staged_funcs).
+
+    Stage k function returns its cache list, to be passed to later stages.
+
+    """
+
+    stages_code = optimization.stage_code( code, input_groups, cache_name )
+    last = len(stages_code) - 1
+
+    pycode = ''
+    parms = []
+    for k, stage_code in enumerate(stages_code):
+        caches = [cache_name + str(j) for j in range(k)]
+        parms += list(func_parms[k])
+        outvar = outvar_name if k == last else cache_name + str(k)
+        if k: pycode += '\n\n'
+        pycode += gen_py_func( stage_code, caches + parms, func_name + '_stage' + str(k), outvar )
+
+    return pycode
+
+
+def _code_item_string( code, i, outvar_name, indent, line_end ):
+    n = len(code[0])
+    if i < n:
+        return indent + sympy.ccode( code[0][i][0] ) + ' = ' + _ccode( code[0][i][1] ) + line_end + '\n'
+    else:
+        return indent + outvar_name + '['+str(i-n)+'] = ' + _ccode( code[1][i-n] ) + line_end + '\n'
+
+def gen_c_parallel_func( code, func_parms, func_name='func', outvar_name='out', min_cluster_cost=100 ):
+    """Generate a C function evaluating independent clusters of code as OpenMP tasks.
+
+    See scheduling.schedule_code. Returns (c code string, schedule report).
+
+    """
+
+    schedule, report = scheduling.schedule_code( code, min_cluster_cost )
+
+    indent = 2*' '
+
+    ccode = 'void ' + func_name + '( double* ' + outvar_name
+    for parm in func_parms :
+        ccode += ', const double* ' + parm
+    ccode += ' )\n{\n'
+
+    ivs = [sympy.ccode( iv ) for iv, se in code[0]]
+    for i in range(0, len(ivs), 10):
+        ccode += indent + 'double ' + ', '.join(ivs[i:i+10]) + ';\n'
+
+    ccode += '\n#pragma omp parallel\n#pragma omp single\n' + indent + '{\n'
+    for l, clusters in enumerate(schedule):
+        ccode += '\n' + 2*indent + '// level ' + str(l) + '\n'
+        if len(clusters) == 1:
+            for i in clusters[0]:
+                ccode += _code_item_string( code, i, outvar_name, 2*indent, ';' )
+        else:
+            for cluster in clusters:
+                ccode += '#pragma omp task\n' + 2*indent + '{\n'
+                for i in cluster:
+                    ccode += _code_item_string( code, i, outvar_name, 3*indent, ';' )
+                ccode += 2*indent + '}\n'
+            ccode += '#pragma omp taskwait\n'
+    ccode += indent + '}\n'
+
+    ccode += '\n' + indent + 'return;\n}'
+
+    return ccode, report
+
+def gen_py_parallel_func( code, func_parms, func_name='func', outvar_name='out', min_cluster_cost=100, tmpvar_name='v' ):
+    """Generate a Python function evaluating independent clusters of code in a thread pool.
+
+    The generated function takes an additional last 'executor' parameter
+    (e.g. a concurrent.futures.ThreadPoolExecutor) and keeps the temporaries in
+    a 'tmpvar_name' list shared by the cluster functions, which is worth it when
+    the code operates on large (GIL releasing) arrays.
+    See scheduling.schedule_code. Returns (python code string, schedule report).
+
+    """
+
+    schedule, report = scheduling.schedule_code( code, min_cluster_cost )
+
+    tmp_replace = {iv: sympy.Symbol(tmpvar_name+'['+str(i)+']', real=True) for i, (iv, se) in enumerate(code[0])}
+    code = optimization.xreplace( code, tmp_replace )
+
+    indent = 4*' '
+
+    pycode = 'def ' + func_name + '('
+    pycode += ' ' + ', '.join(list(func_parms) + ['executor']) + ' '
+    pycode += ') :\n\n'
+
+    pycode += indent + outvar_name + ' = [0]*' + str( len(code[1]) ) + '\n'
+    pycode += indent + tmpvar_name + ' = [0]*' + str( len(code[0]) ) + '\n\n'
+
+    levels = []
+    c = 0
+    for clusters in schedule:
+        names = []
+        for cluster in clusters:
+            name = '_c' + str(c)
+            c += 1
+            pycode += indent + 'def ' + name + '() :\n'
+            for i in cluster:
+                pycode += _code_item_string( code, i, outvar_name, 2*indent, '' )
+            names.append(name)
+        levels.append('(' + ', '.join(names) + ',)')
+
+    pycode += '\n' + indent + 'for level in (' + ', '.join(levels) + ') :\n'
+    pycode += 2*indent + 'if len(level) == 1 :\n'
+    pycode += 3*indent + 'level[0]()\n'
+    pycode += 2*indent + 'else :\n'
+    pycode += 3*indent + 'for future in [executor.submit(cluster) for cluster in level] :\n'
+    pycode += 4*indent + 'future.result()\n'
+
+    pycode += '\n' + indent + 'return ' + outvar_name
+
+    pycode = pycode.replace('\n\n','\n#\n')
+
+    return pycode, report
+
+
+def gen_c_split_funcs( code, func_parms, func_name='func', outvar_name='out', max_items=1000, arena_name='arena', separate_files=False ):
+    """Generate C code computing code split into part functions of bounded size.
+
+    See optimization.split_code. The '<func_name>_part<k>' functions pass
+    the values live across parts through an arena of <FUNC_NAME>_ARENA_LEN
+    doubles; '<func_name>_arena' calls them with a caller supplied arena, and
+    'func_name' (same signature as gen_c_func) with a heap allocated one,
+    aborting if it cannot be allocated.
+    With 'separate_files', the code is returned as a list of (file name, source)
+    pairs: a header, one translation unit per part and one for the drivers,
+    so parts can be compiled in parallel.
+
+    Returns (code, report) where report has the number of 'parts' and the 'arena_len'.
+
+    """
+
+    parts, arena_len = optimization.split_code( code, max_items, arena_name )
+
+    indent = 2*' '
+    define = func_name.upper() + '_ARENA_LEN'
+    static = '' if separate_files else 'static '
+
+    def _signature(name, arena=True):
+        sig = 'void ' + name + '( double* ' + outvar_name
+        if arena:
+            sig += ', double* ' + arena_name
+        for parm in func_parms :
+            sig += ', const double* ' + parm
+        return sig + ' )'
+
+    parts_code = []
+    for k, (subexprs, outs, stores) in enumerate(parts):
+        ccode = static + _signature( func_name + '_part' + str(k) ) + '\n{\n'
+        for iv, se in subexprs:
+            ccode += indent + 'double ' + sympy.ccode( iv ) + ' = ' + _ccode( se ) + ';\n'
+        ccode += '//\n'
+        for i, expr in outs:
+            ccode += indent + outvar_name + '[' + str(i) + '] = ' + _ccode( expr ) + ';\n'
+        for slot, iv in stores:
+            ccode += indent + arena_name + '[' + str(slot) + '] = ' + sympy.ccode( iv ) + ';\n'
+        ccode += '//\n' + indent + 'return;\n}\n'
+        parts_code.append(ccode)
+
+    args = ', '.join([outvar_name, arena_name] + list(func_parms))
+    drivers = _signature( func_name + '_arena' ) + '\n{\n'
+    for k in range(len(parts)):
+        drivers += indent + func_name + '_part' + str(k) + '( ' + args + ' );\n'
+    drivers += indent + 'return;\n}\n\n'
+    drivers += _signature( func_name, False ) + '\n{\n'
+    drivers += indent + 'double* ' + arena_name + ' = (double*)malloc((' + define + ' > 0 ? ' + define + ' : 1)*sizeof(double));\n'
+    drivers += indent + 'if (!' + arena_name + ') abort();\n'
+    drivers += indent + func_name + '_arena( ' + args + ' );\n'
+    drivers += indent + 'free(' + arena_name + ');\n'
+    drivers += indent + 'return;\n}\n'
+
+    report = {'parts': len(parts), 'arena_len': arena_len}
+
+    if not separate_files:
+        ccode = '#include <stdlib.h>\n\n#define ' + define + ' ' + str(arena_len) + '\n\n'
+        ccode += '\n'.join(parts_code) + '\n' + drivers
+        return ccode, report
+
+    header = '#ifndef ' + func_name.upper() + '_H\n#define ' + func_name.upper() + '_H\n\n'
+    header += '#define ' + define + ' ' + str(arena_len) + '\n\n'
+    for k in range(len(parts)):
+        header += _signature( func_name + '_part' + str(k) ) + ';\n'
+    header += _signature( func_name + '_arena' ) + ';\n'
+    header += _signature( func_name, False ) + ';\n'
+    header += '\n#endif\n'
+
+    files = [(func_name + '.h', header)]
+    for k, ccode in enumerate(parts_code):
+        files.append((func_name + '_part' + str(k) + '.c', '#include <math.h>\n#include "' + func_name + '.h"\n\n' + ccode))
+    files.append((func_name + '.c', '#include <stdlib.h>\n#include "' + func_name + '.h"\n\n' + drivers))
+
+    return files, report
+
+
 def code_to_func( lang, code, func_name, func_parms, symb_replace ):
   lang = lang.lower()
   if lang in ['python','py'] : gen_func = gen_py_func
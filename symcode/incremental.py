@@ -0,0 +1,118 @@
+
+import os
+import pickle
+import sympy
+
+from . import __version__
+from . import subexprs
+from . import cache
+
+
+def _stable_order(code_ivs, previous_order):
+    """Order the assignments as in previous_order (names), new ones before their first use.
+
+    Dependencies are always placed before their uses; assignments not
+    reached from previous_order follow in their code_ivs order.
+
+    """
+
+    defs = dict(code_ivs)
+    pos = {iv: i for i, (iv, se) in enumerate(code_ivs)}
+
+    ordered = []
+    done = set()
+
+    def _visit(iv):
+        if iv in done:
+            return
+        done.add(iv)
+        for dep in sorted([s for s in defs[iv].free_symbols if s in defs], key=pos.get):
+            _visit(dep)
+        ordered.append((iv, defs[iv]))
+
+    for iv in previous_order:
+        if iv in defs:
+            _visit(iv)
+    for iv, se in code_ivs:
+        _visit(iv)
+
+    return ordered
+
+
+class IncrementalCollector(object):
+    """Subexpressions collector regenerating code only for the changed outputs.
+
+    The Subexprs(**subexprs_options) tables, the input expressions, their
+    collected outputs and the assignment order of the last run are retained
+    (and stored in 'path', if given, to be reused by later processes).
+    update diffs the new expressions against them, by position, and only
+    collects the changed (or added) ones against the retained tables.
+    Temporaries are named 'ivarnames' followed by the index of their
+    internal temporary, and unaffected assignments keep their previous
+    order, so most of the generated code (and of its compile caches and
+    split translation units) is unchanged.
+
+    """
+
+    def __init__(self, path=None, ivarnames='x', **subexprs_options):
+
+        self.path = path
+        self.ivarnames = ivarnames
+        self.subexprs_options = subexprs_options
+        self._state = None
+
+        if path is not None and os.path.exists(path):
+            with open(path, 'rb') as f:
+                state = pickle.load(f)
+            if state['version'] == __version__ and state['options'] == self._options_key():
+                self._state = state
+
+    def _options_key(self):
+        return cache._option_repr((self.ivarnames, self.subexprs_options))
+
+    def _ivar_name(self, tmp):
+        return sympy.Symbol(self.ivarnames + tmp.name[3:])
+
+    def update(self, exprs):
+        """Return (code, report) of exprs, recollecting only the outputs changed since the last run.
+
+        'report' holds whether it was a 'full' run, the 'changed' output
+        indices, and the number of 'assignments' of which 'kept' are the
+        same (name and subexpression) as in the previous code.
+
+        """
+
+        exprs = [sympy.sympify(expr) for expr in exprs]
+        state = self._state
+
+        if state is None:
+            se = subexprs.Subexprs(**self.subexprs_options)
+            outputs = [None]*len(exprs)
+            changed = list(range(len(exprs)))
+            previous_ivs = []
+        else:
+            se = state['se']
+            old = state['exprs']
+            outputs = state['outputs'][:len(exprs)] + [None]*(len(exprs) - len(old))
+            changed = [i for i, expr in enumerate(exprs) if i >= len(old) or expr != old[i]]
+            previous_ivs = state['code_ivs']
+
+        for i, out in zip(changed, se.collect([exprs[i] for i in changed])):
+            outputs[i] = out
+
+        code_ivs, code_exprs = se.get(outputs, symbols=self._ivar_name)
+        code_ivs = _stable_order(code_ivs, [iv for iv, subexpr in previous_ivs])
+        code = (code_ivs, code_exprs)
+
+        previous = dict(previous_ivs)
+        kept = sum(1 for iv, subexpr in code_ivs if iv in previous and previous[iv] == subexpr)
+        report = {'full': state is None, 'changed': changed, 'assignments': len(code_ivs), 'kept': kept}
+
+        self._state = {'version': __version__, 'options': self._options_key(), 'se': se,
+                       'exprs': exprs, 'outputs': outputs, 'code_ivs': code_ivs}
+        if self.path is not None:
+            with open(self.path + '.tmp', 'wb') as f:
+                pickle.dump(self._state, f, 2)
+            os.rename(self.path + '.tmp', self.path)
+
+        return code, report
@@ -2,9 +2,12 @@
 import collections
 import copy
 import sympy
+from sympy.simplify import cse_main
 import sys
+import time
 
 from . import subexprs
+from . import costmodel
 
 
 def dead_code_elim( code ):
@@ -66,38 +69,37 @@ def inlining_singleops( code ):
     return (subexprs_ordereddict.items(), out_exps)
 
 
-def copy_propag( code, symmetric_copy=False, debug = False ):
-    """Performe 'copy propagation' optimization on code."""
+def copy_propag( code, symmetric_copy=False, debug = False, deadline=None ):
+    """Performe 'copy propagation' optimization on code.
+
+    All copies are propagated in a single pass (see substitute).
+    If a 'deadline' (time.time() value) is given, copies are no longer
+    looked for once it is reached, returning the (valid) code optimized so far.
+
+    """
     
-    removed=0
+    subs = {}
+    rewrite = _rewriter( subs )
     
-    retcode = copy.deepcopy(code)
-    toremove = []
+    subexprs = []
+    searching = True
     
-    for i in range(len(retcode[0])):
-      
-       # constant folding
-        v = retcode[0][i][0]
-        e = retcode[0][i][1]
-        retcode[0][i] = (v,e)
+    for v, e in code[0]:
         
-        # copy propagation
-        if e.is_Atom or (symmetric_copy and (-e).is_Atom):
-            if debug: print(i,v,e,'is atom')
-            retcode = xreplace( retcode, {v:e} )
-            toremove.append(i)
-            removed += 1
-            if debug: print('  poped')
-
-    for r in reversed(toremove):
-        retcode[0].pop(r)
+        if searching and deadline is not None and time.time() > deadline: searching = False
         
-    # output expression constant folding
-    for i,e in enumerate(retcode[1]):
-      retcode[1][i] = e
+        # earlier copies are already propagated into e
+        e = rewrite(e)
+        
+        # copy propagation
+        if searching and (e.is_Atom or (symmetric_copy and (-e).is_Atom)):
+            if debug: print(v,e,'is atom')
+            subs[v] = e
+        else:
+            subexprs.append((v, e))
     
-    if debug: print('removed',removed)
-    return retcode
+    if debug: print('removed',len(subs))
+    return subexprs, [rewrite(sympy.sympify(e)) for e in code[1]]
 
 
 def constant_fold( code ):
@@ -110,10 +112,71 @@ def constant_fold( code ):
         
     for i,e in enumerate(code[1]):
         retcode[1][i] = e.n()
-    
+
     return retcode
-  
-  
+
+
+def _poolable( const ):
+    """Whether the constant expression const is worth precomputing."""
+
+    if const.is_Integer or const.is_Float or const.is_NumberSymbol:
+        return False
+    return True
+
+
+def constant_pool( code, constname='k' ):
+    """Pool the constant subexpressions of code into precomputed constants.
+
+    Constant-only subtrees (e.g. sqrt(70)) and the constant factors or terms
+    of products and sums (e.g. 2/315*sqrt(70) of 2/315*sqrt(70)*x0) are
+    folded exactly by sympy and replaced by symbols named 'constname'
+    followed by an index, the same constant (up to sign) getting the same
+    symbol all across code. Integers, floats and named constants (pi, E) are
+    left in place, as are the numeric exponents of powers.
+
+    Returns (code, constants), with constants the list of (symbol, exact
+    value) to be emitted as precomputed literals (see the 'constants'
+    argument of generation.gen_c_func and gen_py_func).
+
+    """
+
+    pool = collections.OrderedDict()
+    memo = {}
+
+    def _const(const):
+        sign = 1
+        if const.could_extract_minus_sign():
+            const, sign = -const, -1
+        if const not in pool:
+            pool[const] = sympy.Symbol(constname + str(len(pool)), real=True)
+        return sign * pool[const]
+
+    def _pool(expr):
+        if expr in memo:
+            return memo[expr]
+        if not expr.free_symbols:
+            new = _const(expr) if _poolable(expr) else expr
+        elif expr.is_Pow and expr.exp.is_Number:
+            new = sympy.Pow(_pool(expr.base), expr.exp)
+        elif expr.is_Add or expr.is_Mul:
+            consts = [arg for arg in expr.args if not arg.free_symbols]
+            args = [_pool(arg) for arg in expr.args if arg.free_symbols]
+            if consts:
+                const = expr.func(*consts)
+                args.append(_const(const) if _poolable(const) else const)
+            new = expr.func(*args)
+        elif expr.args:
+            new = expr.func(*[_pool(arg) for arg in expr.args])
+        else:
+            new = expr
+        memo[expr] = new
+        return new
+
+    retcode = ([(iv, _pool(se)) for iv, se in code[0]], [_pool(sympy.sympify(e)) for e in code[1]])
+
+    return retcode, [(symbol, const) for const, symbol in pool.items()]
+
+
 
 def apply_func( code, func, apply_to_ivs=True ):
     if apply_to_ivs:
@@ -124,14 +187,76 @@ def apply_func( code, func, apply_to_ivs=True ):
     return code_ivs, code_exprs
 
 
+def _rewriter( subs, chains=True ):
+    """Return a function applying the substitutions 'subs' to expressions.
+
+    Results are memoized across calls, so rewriting all the expressions of
+    code traverses each distinct subexpression once. With 'chains', the
+    substituted expressions are rewritten too (a->b and b->c give a->c).
+    The 'subs' dict may grow between calls as long as the added keys do not
+    appear in the already rewritten expressions.
+
+    """
+
+    memo = {}
+    resolving = set()
+
+    def _rewrite(expr):
+        try:
+            return memo[expr]
+        except KeyError:
+            pass
+        if expr in subs:
+            new = sympy.sympify(subs[expr])
+            if chains:
+                if expr in resolving:
+                    raise Exception('cyclic substitution of ' + str(expr) + '.')
+                resolving.add(expr)
+                new = _rewrite(new)
+                resolving.discard(expr)
+        elif not expr.args:
+            new = expr
+        else:
+            args = [_rewrite(arg) for arg in expr.args]
+            if any(new_arg is not arg for new_arg, arg in zip(args, expr.args)):
+                new = expr.func(*args)
+            else:
+                new = expr
+        memo[expr] = new
+        return new
+
+    return _rewrite
+
+
+def substitute( code, subs, chains=True, apply_to_ivs=False ):
+    """Apply all the substitutions 'subs' to code in a single memoized traversal.
+
+    With 'chains', substitutions are resolved transitively (e.g. substituting
+    each ivar by its subexpression inlines them all), otherwise they are
+    simultaneous; 'apply_to_ivs' also substitutes the assigned ivars.
+
+    """
+
+    rewrite = _rewriter( subs, chains )
+
+    # code order rewriting keeps chain resolution recursion shallow
+    if apply_to_ivs:
+        code_ivs = [(rewrite(iv), rewrite(se)) for iv, se in code[0]]
+    else:
+        code_ivs = [(iv, rewrite(se)) for iv, se in code[0]]
+    code_exprs = [rewrite(sympy.sympify(expr)) for expr in code[1]]
+
+    return code_ivs, code_exprs
+
+
 def xreplace( code, xreplace_dict ):
-  return apply_func( code, lambda x: x.xreplace( xreplace_dict ) )
+  return substitute( code, xreplace_dict, chains=False, apply_to_ivs=True )
 
 
 def common_subexpr_elim( code, auxvarname = 'cse' ):
     """Performe 'common sub-expression elimination' optimization on code."""
     
-    cse = sympy.cse([sympy.Eq(v,e) for v,e in code[0]] + list(code[1]), symbols=sympy.cse_main.numbered_symbols(auxvarname), postprocess=sympy.cse_main.cse_separate )
+    cse = sympy.cse([sympy.Eq(v,e) for v,e in code[0]] + list(code[1]), symbols=cse_main.numbered_symbols(auxvarname), postprocess=cse_main.cse_separate )
         
     new_code_out = copy.deepcopy(code[1])
     for i,e in enumerate(cse[1]):
@@ -152,7 +277,7 @@ def common_subexpr_elim_OLD( code, auxvarname = 'cse' ):
     else:
       code_out = code[1]
     
-    cse = sympy.cse(se.subexprs_dict.keys() + code_out,  sympy.cse_main.numbered_symbols(auxvarname) )
+    cse = sympy.cse(list(se.subexprs_dict.keys()) + list(code_out),  cse_main.numbered_symbols(auxvarname) )
     
     cse_new_subexprs = cse[0]
     cse_subexprs = cse[1][:len(code[0])]
@@ -168,8 +293,13 @@ def common_subexpr_elim_OLD( code, auxvarname = 'cse' ):
     return (se.get_subexprs(new_code_out), new_code_out)
     
     
-def inlining( code ):
-    """Performe inlining of once used variables (and elimination of not used variables)."""
+def inlining( code, deadline=None ):
+    """Performe inlining of once used variables (and elimination of not used variables).
+
+    If a 'deadline' (time.time() value) is given, the pass stops when it is
+    reached, returning the (valid) code optimized so far.
+
+    """
     
     debug = False
     removed=0
@@ -177,6 +307,7 @@ def inlining( code ):
     retcode = copy.deepcopy(code)
     
     for i in range(len(retcode[0])-1,-1,-1):
+        if deadline is not None and time.time() > deadline: break
         v = retcode[0][i][0]
         e = retcode[0][i][1]
         uses = 0
@@ -214,29 +345,134 @@ def inlining( code ):
     return retcode
 
 
+def horner( code, cost=None, deadline=None ):
+    """Performe (greedy multivariate) Horner rewriting of polynomial sums on code.
+
+    Sums of products of symbol powers are rewritten by repeatedly factoring out
+    the symbol present in most terms, e.g. a + b*x + c*x**2 becomes
+    a + x*(b + c*x). Temporaries defined as powers of a symbol are considered
+    as such powers, and the earlier defined ones are reused to build the
+    powers left after factoring (e.g. x**5 as x3*x2). A rewriting is only
+    kept if it lowers 'cost' (by default, the estimate of
+    costmodel.CostModel()). Temporaries which become unused are left to be
+    removed by dead code elimination (e.g. inlining).
+    If a 'deadline' (time.time() value) is given, expressions are left as they
+    are once it is reached.
+
+    """
+
+    if cost is None:
+        cost = costmodel.CostModel()
+
+    power_ivs = {}
+    for iv, se in code[0]:
+        if se.is_Pow and se.base.is_Symbol and se.exp.is_Integer and se.exp > 0:
+            power_ivs[iv] = (se.base, int(se.exp))
+    base_powers = collections.defaultdict(dict) # base -> {exp: ivar}, of the temporaries defined so far
+
+    def _term(term):
+        coeff = []
+        powers = {}
+        for factor in (term.args if term.is_Mul else (term,)):
+            if factor in power_ivs:
+                base, exp = power_ivs[factor]
+            elif factor.is_Symbol:
+                base, exp = factor, 1
+            elif factor.is_Pow and factor.base.is_Symbol and factor.exp.is_Integer and factor.exp > 0:
+                base, exp = factor.base, int(factor.exp)
+            else:
+                coeff.append(factor)
+                continue
+            powers[base] = powers.get(base, 0) + exp
+        return coeff, powers
+
+    def _power(base, exp):
+        # reuse the power temporaries (largest first), e.g. x**5 as x3*x2, if cheaper than base**exp
+        defined = base_powers.get(base)
+        if not defined or exp == 1:
+            return base**exp
+        factors = []
+        rest = exp
+        while rest:
+            k = max([k for k in defined if k <= rest] or [0])
+            if not k:
+                factors.append(base**rest)
+                break
+            factors.append(defined[k])
+            rest -= k
+        return min([sympy.Mul(*factors), base**exp], key=cost)
+
+    def _build(coeff, powers):
+        return sympy.Mul(*(coeff + [_power(base, exp) for base, exp in powers.items()]))
+
+    def _horner(terms):
+        counts = {}
+        for coeff, powers in terms:
+            for base in powers:
+                counts[base] = counts.get(base, 0) + 1
+        if not counts or max(counts.values()) < 2:
+            return sympy.Add(*[_build(coeff, powers) for coeff, powers in terms])
+        base = max(sorted(counts, key=str), key=lambda b: counts[b])
+
+        with_base = [t for t in terms if base in t[1]]
+        without_base = [t for t in terms if base not in t[1]]
+        exp = min(powers[base] for coeff, powers in with_base)
+
+        reduced = []
+        for coeff, powers in with_base:
+            powers = dict(powers)
+            powers[base] -= exp
+            if not powers[base]:
+                del powers[base]
+            reduced.append((coeff, powers))
+
+        return _power(base, exp) * _horner(reduced) + _horner(without_base)
+
+    memo = {}
+
+    def _rewrite(expr):
+        if expr.is_Atom:
+            return expr
+        if deadline is not None and time.time() > deadline:
+            return expr
+        if expr in memo:
+            return memo[expr]
+        new_expr = expr.func(*[_rewrite(arg) for arg in expr.args])
+        if new_expr.is_Add:
+            horner_expr = _horner([_term(term) for term in new_expr.args])
+            if cost(horner_expr) < cost(new_expr):
+                new_expr = horner_expr
+        memo[expr] = new_expr
+        return new_expr
+
+    code_ivs = []
+    for iv, se in code[0]:
+        code_ivs.append((iv, _rewrite(se)))
+        if iv in power_ivs:
+            base, exp = power_ivs[iv]
+            base_powers[base].setdefault(exp, iv)
+    code_exprs = [_rewrite(expr) for expr in code[1]]
+    return code_ivs, code_exprs
+
+
 def rename_ivars_unsafe(code, ivarnames ):
-    
-  retcode = copy.deepcopy(code)
-   
-  for i in range(len(retcode[0])):
+  """Rename the ivars of code to 'ivarnames' followed by their index.
 
-    new_symbol = sympy.Symbol(ivarnames+str(i),real=True)
-    Dxreplace = { retcode[0][i][0] : new_symbol }
-  
-    retcode[0][i] = ( new_symbol , retcode[0][i][1] )
-        
-    for j in range(i+1,len(retcode[0])):
-      retcode[0][j] = ( retcode[0][j][0], retcode[0][j][1].xreplace( Dxreplace ) )
+  Renaming is simultaneous (see substitute); it is unsafe in that new names
+  may clash with other symbols of code.
+
+  """
   
-    for j in range(len(retcode[1])):
-      retcode[1][j] = sympy.sympify(retcode[1][j]).xreplace( Dxreplace )
+  renames = {}
+  for i, (iv, se) in enumerate(code[0]):
+    renames[iv] = sympy.Symbol(ivarnames+str(i),real=True)
   
-  return retcode
+  return substitute(code, renames, chains=False, apply_to_ivs=True)
 
 
 def make_output_single_vars(code, ivarnames=None ):
 
-    retcode = copy.deepcopy(code)
+    retcode = (list(code[0]), list(code[1]))
 
     if ivarnames:
         cnt = 0
@@ -264,7 +500,250 @@ def make_output_single_vars(code, ivarnames=None ):
             cnt += 1
 
     return retcode
-  
+
+
+def split_shared_code( code, group_lens, ctx_name='ctx' ):
+    """Split code whose outputs are concatenated groups into a shared core and per group codes.
+
+    Subexpressions needed by more than one group go into the core code, whose
+    outputs are the context values referenced by the groups; in the group codes
+    those subexpressions are replaced by 'ctx_name[i]' symbols.
+
+    Returns (core_code, [group_code, ...]).
+
+    """
+
+    if sum(group_lens) != len(code[1]):
+        raise Exception('group lengths do not match the number of output expressions.')
+
+    subexprs_invdict = dict(code[0])
+    ivs_set = set(subexprs_invdict.keys())
+
+    deps = {}
+    for iv, se in code[0]:
+        deps[iv] = se.free_symbols & ivs_set
+
+    groups_outs = []
+    i = 0
+    for l in group_lens:
+        groups_outs.append(list(code[1][i:i+l]))
+        i += l
+
+    # temporaries (transitively) needed by each group
+    groups_ivs = []
+    for outs in groups_outs:
+        needed = set()
+        tovisit = set()
+        for expr in outs:
+            tovisit |= sympy.sympify(expr).free_symbols & ivs_set
+        while tovisit:
+            iv = tovisit.pop()
+            if iv not in needed:
+                needed.add(iv)
+                tovisit |= deps[iv] - needed
+        groups_ivs.append(needed)
+
+    usage = collections.Counter()
+    for needed in groups_ivs:
+        usage.update(needed)
+    core_ivs = set(iv for iv, n in usage.items() if n > 1)
+
+    # core temporaries referenced from group code are exported through the context
+    exported = set()
+    for outs, needed in zip(groups_outs, groups_ivs):
+        for iv in needed - core_ivs:
+            exported |= deps[iv] & core_ivs
+        for expr in outs:
+            exported |= sympy.sympify(expr).free_symbols & core_ivs
+
+    core_subexprs = [(iv, se) for iv, se in code[0] if iv in core_ivs]
+    core_outs = [iv for iv, se in core_subexprs if iv in exported]
+
+    ctx_replace = {iv: sympy.Symbol(ctx_name+'['+str(i)+']', real=True) for i, iv in enumerate(core_outs)}
+
+    groups_code = []
+    for outs, needed in zip(groups_outs, groups_ivs):
+        group_subexprs = [(iv, se.xreplace(ctx_replace)) for iv, se in code[0] if iv in needed and iv not in core_ivs]
+        group_outs = [sympy.sympify(expr).xreplace(ctx_replace) for expr in outs]
+        groups_code.append((group_subexprs, group_outs))
+
+    return (core_subexprs, core_outs), groups_code
+
+
+def stage_code( code, input_groups, cache_name='cache' ):
+    """Split code into stages according to the input groups each subexpression depends on.
+
+    'input_groups' is a list of symbol lists, from the most rarely changing
+    inputs to the most frequently changing ones (symbols in no group are
+    treated as belonging to the first one).
+    Each subexpression goes to the stage of the last input group it (transitively)
+    depends on. Stage k code outputs the values cached in 'cache_name<k>', which
+    later stages read through 'cache_name<k>[i]' symbols, and the last stage
+    code outputs the original output expressions.
+
+    Returns the list of stage codes.
+
+    """
+
+    last = len(input_groups) - 1
+
+    stage = {}
+    for k, symbs in enumerate(input_groups):
+        for symb in symbs:
+            if isinstance(symb, str): symb = sympy.Symbol(symb)
+            stage[symb] = k
+
+    def _stage(expr):
+        return max([stage.get(symb, 0) for symb in expr.free_symbols] or [0])
+
+    ivs_set = set()
+    for iv, se in code[0]:
+        stage[iv] = _stage(se)
+        ivs_set.add(iv)
+
+    outs = [sympy.sympify(expr) for expr in code[1]]
+
+    # values computed in an earlier stage and read by a later one
+    stages_cached = [[] for k in range(last + 1)]
+    cached = set()
+
+    def _cache_reads(expr, k):
+        for symb in sorted(expr.free_symbols & ivs_set, key=str):
+            if stage[symb] < k and symb not in cached:
+                cached.add(symb)
+                stages_cached[stage[symb]].append(symb)
+
+    for iv, se in code[0]:
+        _cache_reads(se, stage[iv])
+
+    # outputs not depending on the last stage inputs are cached too
+    stages_cached_outs = [[] for k in range(last + 1)]
+    for i, expr in enumerate(outs):
+        k = _stage(expr)
+        if k < last and not expr.is_Atom:
+            stages_cached_outs[k].append(i)
+            _cache_reads(expr, k)
+        else:
+            _cache_reads(expr, last)
+
+    cache_replace = {}
+    outs_replace = {}
+    for k in range(last):
+        for j, iv in enumerate(stages_cached[k]):
+            cache_replace[iv] = sympy.Symbol(cache_name+str(k)+'['+str(j)+']', real=True)
+        for j, i in enumerate(stages_cached_outs[k]):
+            j += len(stages_cached[k])
+            outs_replace[i] = sympy.Symbol(cache_name+str(k)+'['+str(j)+']', real=True)
+
+    stages_code = []
+    for k in range(last + 1):
+        # only values of earlier stages are read from the caches
+        replace = {iv: symb for iv, symb in cache_replace.items() if stage[iv] < k}
+        subexprs = [(iv, se.xreplace(replace)) for iv, se in code[0] if stage[iv] == k]
+        if k < last:
+            stage_outs = list(stages_cached[k])
+            stage_outs += [outs[i].xreplace(replace) for i in stages_cached_outs[k]]
+        else:
+            stage_outs = [outs_replace[i] if i in outs_replace else expr.xreplace(replace)
+                          for i, expr in enumerate(outs)]
+        stages_code.append((subexprs, stage_outs))
+
+    # each stage may only read the inputs of its and earlier groups, its own
+    # ivars and the caches of earlier stages
+    caches = set(cache_replace.values()) | set(outs_replace.values())
+    for k, (subexprs, stage_outs) in enumerate(stages_code):
+        available = set(iv for iv, se in subexprs)
+        available |= set(symb for iv, symb in cache_replace.items() if stage[iv] < k)
+        available |= set(symb for i, symb in outs_replace.items() if _stage(outs[i]) < k)
+        for expr in [se for iv, se in subexprs] + list(stage_outs):
+            for symb in expr.free_symbols:
+                if symb not in available and (symb in ivs_set or symb in caches or stage.get(symb, 0) > k):
+                    raise Exception('stage ' + str(k) + ' reads ' + str(symb) + ', which is not available to it.')
+
+    return stages_code
+
+
+def split_code( code, max_items=1000, arena_name='arena' ):
+    """Split code into parts of at most 'max_items' items communicating through an arena.
+
+    Subexpressions and outputs both count as items: each output follows the
+    last subexpression it uses, and outputs overflowing a part spill into
+    the next ones.
+    Only values used by later parts are stored in the 'arena_name' buffer,
+    whose slots are reused once their values are no longer used, and later
+    parts read them through 'arena_name[i]' symbols.
+
+    Returns (parts, arena length) where each part is a tuple of the
+    subexpressions list, the (output index, expression) list and the
+    (arena slot, ivar) stores list.
+
+    """
+
+    iv_index = {iv: i for i, (iv, se) in enumerate(code[0])}
+    outs = [sympy.sympify(expr) for expr in code[1]]
+
+    # sequence of items, outputs right after the last subexpression they use
+    outs_after = collections.defaultdict(list)
+    for i, expr in enumerate(outs):
+        outs_after[max([iv_index[symb] for symb in expr.free_symbols if symb in iv_index] or [-1])].append(i)
+    items = [(None, i) for i in outs_after[-1]]
+    for j in range(len(code[0])):
+        items.append((j, None))
+        items += [(None, i) for i in outs_after[j]]
+
+    nparts = max(1, (len(items) + max_items - 1) // max_items)
+    parts_subexprs = [[] for p in range(nparts)]
+    parts_outs = [[] for p in range(nparts)]
+    iv_part = {}
+    for k, (j, i) in enumerate(items):
+        p = k // max_items
+        if j is not None:
+            parts_subexprs[p].append(code[0][j])
+            iv_part[code[0][j][0]] = p
+        else:
+            parts_outs[p].append(i)
+
+    last_use = {}
+    def _uses(expr, p):
+        for symb in expr.free_symbols:
+            if symb in iv_part:
+                last_use[symb] = max(last_use.get(symb, p), p)
+
+    for p in range(nparts):
+        for iv, se in parts_subexprs[p]:
+            _uses(se, p)
+        for i in parts_outs[p]:
+            _uses(outs[i], p)
+
+    arena_replace = {}
+    free_slots = []
+    released = collections.defaultdict(list)
+    arena_len = 0
+
+    parts = []
+    for p in range(nparts):
+        free_slots += released.pop(p, [])
+
+        # arena_replace only holds values of earlier parts here
+        subexprs = [(iv, se.xreplace(arena_replace)) for iv, se in parts_subexprs[p]]
+        part_outs = [(i, outs[i].xreplace(arena_replace)) for i in parts_outs[p]]
+
+        stores = []
+        for iv, se in parts_subexprs[p]:
+            if last_use.get(iv, p) > p:
+                if free_slots:
+                    slot = free_slots.pop()
+                else:
+                    slot = arena_len
+                    arena_len += 1
+                stores.append((slot, iv))
+                arena_replace[iv] = sympy.Symbol(arena_name+'['+str(slot)+']', real=True)
+                released[last_use[iv] + 1].append(slot)
+
+        parts.append((subexprs, part_outs, stores))
+
+    return parts, arena_len
+
 
 def _fprint(x):
   print(x)
@@ -313,3 +792,82 @@ def fully_optimize_code( code, ivarnames=None, singlevarout=False, clearcache=0,
   return code
 
 
+
+
+# (name, pass function(code, deadline), interruptible, expected benefit, relative time)
+anytime_passes = [
+  ('copy_propag', lambda code, deadline: copy_propag(code, deadline=deadline), True, 1, 1),
+  ('horner', lambda code, deadline: horner(code, deadline=deadline), True, 2, 2),
+  ('inlining', lambda code, deadline: inlining(code, deadline=deadline), True, 3, 10),
+  ('common_subexpr_elim', lambda code, deadline: common_subexpr_elim(code, 'cse'), False, 10, 50),
+]
+
+
+def anytime_optimize_code( code, budget, passes=None, cost=None, debug=False ):
+  """Optimize code within a time budget (in seconds).
+
+  Passes (see anytime_passes) are run in decreasing order of expected benefit
+  per unit of time. Interruptible passes are given the remaining budget as
+  deadline, the others are skipped if their time, predicted from the
+  previously run passes, exceeds it. A pass result is kept only if it lowers
+  the code 'cost' (costmodel.CostModel() by default).
+
+  Returns (code, report) where code is the best code found and report is a
+  dict with the initial and final costs, the elapsed time and, in 'passes',
+  the name, status ('completed', 'interrupted', 'rejected', 'skipped' or
+  'failed', with the 'error' message), time and resulting cost of each pass.
+
+  """
+
+  if passes is None:
+    passes = anytime_passes
+  if cost is None:
+    cost = costmodel.CostModel()
+
+  start = time.time()
+  deadline = start + budget
+
+  best_cost = cost.code_cost(code)
+  report = {'initial_cost': best_cost, 'passes': []}
+
+  # seconds per unit of relative time and code cost, measured on the run passes
+  rate = None
+
+  for name, func, interruptible, benefit, reltime in sorted(passes, key=lambda p: -float(p[3])/p[4]):
+
+    remaining = deadline - time.time()
+    predicted = rate * reltime * best_cost if rate is not None else 0
+    if remaining <= 0 or (not interruptible and predicted > remaining):
+      report['passes'].append({'name': name, 'status': 'skipped', 'time': 0, 'cost': None})
+      if debug: _fprint(' ' + name + ' skipped')
+      continue
+
+    if debug: _fprint(' ' + name)
+    pass_start = time.time()
+    try:
+      new_code = func(code, deadline)
+      new_cost = cost.code_cost(new_code)
+    except Exception as e:
+      # a failing pass leaves the best code so far untouched
+      report['passes'].append({'name': name, 'status': 'failed', 'time': time.time() - pass_start, 'cost': None,
+                               'error': type(e).__name__ + ': ' + str(e)})
+      if debug: _fprint(' ' + name + ' failed: ' + str(e))
+      continue
+    pass_time = time.time() - pass_start
+
+    if best_cost:
+      rate = max(rate or 0, pass_time / (reltime * best_cost))
+
+    if new_cost < best_cost:
+      code, best_cost = new_code, new_cost
+      status = 'interrupted' if time.time() > deadline else 'completed'
+    else:
+      status = 'rejected'
+    report['passes'].append({'name': name, 'status': status, 'time': pass_time, 'cost': new_cost})
+
+  report['final_cost'] = best_cost
+  report['elapsed'] = time.time() - start
+
+  if debug: print(' done')
+
+  return code, report
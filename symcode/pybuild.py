@@ -0,0 +1,53 @@
+
+import hashlib
+import os
+import sympy
+
+from . import __version__
+from . import generation
+from . import runtime
+
+
+default_cache_dir = runtime.cache_dirs['py']
+
+# bump when the generated module source changes for the same code and names
+format_version = '1'
+
+_funcs = {}
+
+
+def build_py_func( code, func_parms, func_name='func', outvar_name='out', cache_dir=None ):
+    """Return the compiled Python function of code (see generation.gen_py_fast_func).
+
+    Functions are memoized by a hash of the code srepr and names, the symcode
+    version and the module format_version, both in memory and as modules in
+    'cache_dir' (by default ~/.cache/symcode/py), whose bytecode is in turn
+    cached by Python, so the same code is only generated and compiled once. The function module (its __module__) can
+    later be loaded without sympy with runtime.load.
+
+    """
+
+    if cache_dir is None:
+        cache_dir = default_cache_dir
+
+    key = hashlib.sha1()
+    for item in [sympy.srepr(list(code[0])), sympy.srepr(list(code[1])), repr(list(func_parms)), func_name, outvar_name,
+                 __version__, format_version]:
+        key.update(item.encode('utf-8'))
+    modname = func_name + '_' + key.hexdigest()[:16]
+
+    if modname in _funcs:
+        return _funcs[modname]
+
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+
+    path = os.path.join(cache_dir, modname + '.py')
+    if not os.path.exists(path):
+        source = generation.gen_py_fast_func(code, func_parms, func_name, outvar_name)
+        with open(path + '.tmp', 'w') as f:
+            f.write(source)
+        os.rename(path + '.tmp', path)
+
+    _funcs[modname] = getattr(runtime.load_module(modname, path), func_name)
+    return _funcs[modname]
@@ -0,0 +1,77 @@
+
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+
+from . import runtime
+
+
+default_cache_dir = runtime.cache_dirs['pyx']
+
+_modules = {}
+
+
+def build_pyx( source, name='symcode_pyx', cache_dir=None, openmp=None, extra_compile_args=None ):
+    """Compile Cython module source (e.g. from generation.gen_pyx_module) and import it.
+
+    Built extension modules are cached in 'cache_dir' (by default
+    ~/.cache/symcode/pyx) under a name made from 'name' and a hash of the
+    source, the build options and the Cython and Python versions, so the
+    same source is only compiled once. 'openmp' (by default, if the source
+    uses prange) adds the OpenMP compiler and linker flags.
+
+    Returns the imported module, which can later be loaded by its name,
+    without sympy nor Cython, with runtime.load.
+
+    """
+
+    import Cython
+    from Cython.Build import cythonize
+    from setuptools import Distribution, Extension
+
+    if cache_dir is None:
+        cache_dir = default_cache_dir
+    if openmp is None:
+        openmp = 'prange' in source
+    extra_compile_args = list(extra_compile_args or ['-O3'])
+    extra_link_args = []
+    if openmp:
+        extra_compile_args.append('-fopenmp')
+        extra_link_args.append('-fopenmp')
+
+    key = hashlib.sha1()
+    for item in [source, repr(extra_compile_args), repr(extra_link_args), Cython.__version__, sys.version]:
+        key.update(item.encode('utf-8'))
+    modname = name + '_' + key.hexdigest()[:16]
+
+    if modname in _modules:
+        return _modules[modname]
+
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+
+    def _build_ext(ext_modules):
+        build_ext = Distribution({'ext_modules': ext_modules}).get_command_obj('build_ext')
+        build_ext.build_lib = cache_dir
+        build_ext.ensure_finalized()
+        return build_ext
+
+    pyxpath = os.path.join(cache_dir, modname + '.pyx')
+    ext = Extension(modname, [pyxpath], extra_compile_args=extra_compile_args, extra_link_args=extra_link_args)
+    path = _build_ext([ext]).get_ext_fullpath(modname)
+
+    if not os.path.exists(path):
+        with open(pyxpath, 'w') as f:
+            f.write(source)
+        build_temp = tempfile.mkdtemp(prefix='symcode_pyx_')
+        try:
+            build_ext = _build_ext(cythonize([ext], quiet=True, build_dir=build_temp, language_level=3))
+            build_ext.build_temp = build_temp
+            build_ext.run()
+        finally:
+            shutil.rmtree(build_temp, ignore_errors=True)
+
+    _modules[modname] = runtime.load_module(modname, path)
+    return _modules[modname]
@@ -0,0 +1,74 @@
+
+import os
+import sys
+
+
+# the runtime only loads previously generated kernels, so it must not import
+# sympy (nor the codegen modules of symcode, which do)
+
+cache_dirs = {}
+cache_dirs['pyx'] = os.path.join(os.path.expanduser('~'), '.cache', 'symcode', 'pyx')
+cache_dirs['py'] = os.path.join(os.path.expanduser('~'), '.cache', 'symcode', 'py')
+
+_modules = {}
+
+
+def load_module(name, path):
+    """Import the module 'name' from the file 'path' (extension module or Python source)."""
+
+    if sys.version_info[0] < 3:
+        import imp
+        if path.endswith('.py'):
+            return imp.load_source(name, path)
+        return imp.load_dynamic(name, path)
+    import importlib.util
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def find_module(name, cache_dir=None):
+    """Return the path of the cached kernel module 'name', or None.
+
+    The module is looked for in 'cache_dir' or else in cache_dirs (compiled
+    extension modules first, then Python sources).
+
+    """
+
+    dirs = [cache_dir] if cache_dir is not None else [cache_dirs['pyx'], cache_dirs['py']]
+    if sys.version_info[0] < 3:
+        import imp
+        suffixes = [suffix for suffix, mode, kind in imp.get_suffixes() if kind == imp.C_EXTENSION]
+    else:
+        import importlib.machinery
+        suffixes = list(importlib.machinery.EXTENSION_SUFFIXES)
+    suffixes += ['.py']
+
+    for directory in dirs:
+        for suffix in suffixes:
+            path = os.path.join(directory, name + suffix)
+            if os.path.exists(path):
+                return path
+
+    return None
+
+
+def load(name, func_name=None, cache_dir=None):
+    """Load a previously built kernel module without generating nor compiling anything.
+
+    'name' is the cached module name, i.e. the __name__ of a module built by
+    pyxbuild.build_pyx or the __module__ of a function built by
+    pybuild.build_py_func. Returns the module, or its function 'func_name'.
+
+    """
+
+    if name not in _modules:
+        path = find_module(name, cache_dir)
+        if path is None:
+            raise Exception('kernel module ' + name + ' not found in the symcode cache.')
+        _modules[name] = load_module(name, path)
+
+    if func_name is None:
+        return _modules[name]
+    return getattr(_modules[name], func_name)
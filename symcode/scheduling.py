@@ -0,0 +1,154 @@
+
+import sympy
+
+from . import costmodel
+
+
+def code_dependencies( code ):
+    """Return the list of dependencies of each code item.
+
+    Items are the subexpression assignments followed by the output expressions,
+    and the dependencies of an item are the indices of the assignments it uses.
+
+    """
+
+    iv_index = {}
+    for i, (iv, se) in enumerate(code[0]):
+        iv_index[iv] = i
+
+    deps = []
+    for iv, se in code[0]:
+        deps.append(sorted(iv_index[symb] for symb in se.free_symbols if symb in iv_index))
+    for expr in code[1]:
+        deps.append(sorted(iv_index[symb] for symb in sympy.sympify(expr).free_symbols if symb in iv_index))
+
+    return deps
+
+
+def schedule_code( code, min_cluster_cost=100, cost=None ):
+    """Schedule code items into levels of independent clusters.
+
+    Items of each dependency level are packed, in code order, into clusters of
+    at least 'min_cluster_cost' estimated cost ('cost', costmodel.CostModel() by default),
+    so each cluster is coarse enough to amortize its scheduling overhead.
+
+    Returns (schedule, report) where schedule is a list of levels, each a list
+    of clusters of code item indices, and report is a dict with the work, the
+    critical path length (both in estimated cost), the available
+    parallelism (work over critical path) and the numbers of items, levels and
+    clusters.
+
+    """
+
+    if cost is None:
+        cost = costmodel.CostModel()
+
+    deps = code_dependencies( code )
+    exprs = [se for iv, se in code[0]] + [sympy.sympify(expr) for expr in code[1]]
+    items_cost = [cost(expr) for expr in exprs]
+
+    item_level = []
+    item_finish = []
+    levels = []
+    for i, item_deps in enumerate(deps):
+        l = max([item_level[d] + 1 for d in item_deps] or [0])
+        item_level.append(l)
+        item_finish.append(items_cost[i] + max([item_finish[d] for d in item_deps] or [0]))
+        if l == len(levels):
+            levels.append([])
+        levels[l].append(i)
+
+    schedule = []
+    for level in levels:
+        clusters = []
+        cluster = []
+        cluster_cost = 0
+        for i in level:
+            cluster.append(i)
+            cluster_cost += items_cost[i]
+            if cluster_cost >= min_cluster_cost:
+                clusters.append(cluster)
+                cluster = []
+                cluster_cost = 0
+        if cluster:
+            if clusters:
+                clusters[-1].extend(cluster)
+            else:
+                clusters.append(cluster)
+        schedule.append(clusters)
+
+    work = sum(items_cost)
+    critical_path = max(item_finish or [0])
+
+    report = {}
+    report['items'] = len(deps)
+    report['levels'] = len(levels)
+    report['clusters'] = sum(len(clusters) for clusters in schedule)
+    report['work'] = work
+    report['critical_path'] = critical_path
+    report['parallelism'] = float(work) / critical_path if critical_path else 1.0
+
+    return schedule, report
+
+
+def profile_sections( code, sections='outputs', min_cluster_cost=100, cost=None ):
+    """Split code items into sections to be timed separately.
+
+    'sections' is 'outputs' (each output with the assignments it is the first
+    to need, plus a last section of unused assignments if any), 'clusters'
+    (the dependency clusters of schedule_code) or a number N (runs of N
+    consecutive items).
+
+    Returns the list of sections, each a dict with the code item indices
+    ('items', see code_dependencies), in an order valid to evaluate the
+    sections one after another, and the 'outputs' (indices) and
+    'temporaries' (ivars) they compute.
+
+    """
+
+    n = len(code[0])
+    nitems = n + len(code[1])
+
+    if sections == 'outputs':
+        deps = code_dependencies( code )
+        done = set()
+        groups = []
+        for i in range(n, nitems):
+            stack = [i]
+            items = []
+            while stack:
+                for d in deps[stack.pop()]:
+                    if d not in done:
+                        done.add(d)
+                        items.append(d)
+                        stack.append(d)
+            groups.append(sorted(items) + [i])
+        unused = [i for i in range(n) if i not in done]
+        if unused:
+            groups.append(unused)
+    elif sections == 'clusters':
+        schedule, report = schedule_code( code, min_cluster_cost, cost )
+        groups = [cluster for clusters in schedule for cluster in clusters]
+    elif isinstance(sections, int) and sections > 0:
+        groups = [list(range(i, min(i + sections, nitems))) for i in range(0, nitems, sections)]
+    else:
+        raise Exception("sections must be 'outputs', 'clusters' or a number of items.")
+
+    return [{'items': items,
+             'outputs': [i - n for i in items if i >= n],
+             'temporaries': [code[0][i][0] for i in items if i < n]} for items in groups]
+
+
+def profile_report( sections, counters ):
+    """Rank profiled sections by their accumulated counters.
+
+    Returns a list of (share of the total, counter, section), most
+    expensive first, from the 'counters' array of a profiled function (see
+    generation.gen_c_func and gen_py_func).
+
+    """
+
+    total = float(sum(counters)) or 1.0
+    ranked = [(counter / total, counter, section) for counter, section in zip(counters, sections)]
+    ranked.sort(key=lambda r: -r[1])
+    return ranked
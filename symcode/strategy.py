@@ -0,0 +1,242 @@
+
+import logging
+import sympy
+
+from . import subexprs
+from . import optimization
+
+
+logger = logging.getLogger(__name__)
+
+
+def expr_stats( exprs, max_exprs=200, max_nodes=50000 ):
+    """Return cheap structural statistics of expressions.
+
+    Only up to 'max_exprs' evenly spaced expressions (and until 'max_nodes'
+    nodes) are visited, the node count being extrapolated from them.
+    Returns a dict with 'outputs', 'nodes', 'ops' (non atomic nodes), 'addmul'
+    (fraction of Add and Mul operations), 'add_mul_ratio' (Adds over Muls),
+    'functions' (fraction of function operations) and 'depth' (maximum
+    sampled depth).
+
+    """
+
+    if isinstance(exprs, sympy.Basic) and not isinstance(exprs, sympy.MatrixBase):
+        exprs = [exprs]
+    exprs = list(exprs)
+
+    step = max(1, len(exprs) // max_exprs)
+
+    nodes = ops = adds = muls = functions = depth = visited = 0
+    for i in range(0, len(exprs), step):
+        tovisit = [(sympy.sympify(exprs[i]), 1)]
+        while tovisit:
+            expr, d = tovisit.pop()
+            nodes += 1
+            depth = max(depth, d)
+            if not expr.args: continue
+            ops += 1
+            if expr.is_Add: adds += 1
+            elif expr.is_Mul: muls += 1
+            elif expr.is_Function: functions += 1
+            tovisit.extend((arg, d + 1) for arg in expr.args)
+        visited += 1
+        if nodes >= max_nodes:
+            break
+
+    stats = {}
+    stats['outputs'] = len(exprs)
+    stats['nodes'] = nodes * len(exprs) // visited if visited else 0
+    stats['ops'] = ops * len(exprs) // visited if visited else 0
+    stats['addmul'] = float(adds + muls) / ops if ops else 0.0
+    stats['add_mul_ratio'] = float(adds) / muls if muls else float(adds)
+    stats['functions'] = float(functions) / ops if ops else 0.0
+    stats['depth'] = depth
+    return stats
+
+
+def _run_subexprs( exprs ):
+    se = subexprs.Subexprs()
+    return se.get(se.collect(exprs))
+
+def _run_whole( exprs ):
+    se = subexprs.WholeSubexprs()
+    return se.get(se.collect(exprs))
+
+def _run_fast_cse( exprs ):
+    from . import _fast_cse
+    return _fast_cse.cse(exprs)
+
+def _run_sympy_cse( exprs ):
+    return sympy.cse(exprs)
+
+def _run_subexprs_cse( exprs ):
+    code = _run_subexprs(exprs)
+    return optimization.common_subexpr_elim(code, 'cse')
+
+
+# (name, collector function, predicted seconds from stats)
+# the time models are rough linear fits on the sampled node count
+collectors = [
+  ('whole', _run_whole, lambda s: 4e-6 * s['nodes']),
+  ('subexprs', _run_subexprs, lambda s: 5e-5 * s['nodes']),
+  ('fast_cse', _run_fast_cse, lambda s: 5e-5 * s['nodes']),
+  ('sympy_cse', _run_sympy_cse, lambda s: 3e-5 * s['nodes']),
+  ('subexprs+sympy_cse', _run_subexprs_cse, lambda s: 3e-4 * s['nodes']),
+]
+
+
+def _quality_order( stats ):
+    """Collector names from best to worst expected op count for the expressions shape.
+
+    This is a heuristic prior, not a prediction: the single threshold on the
+    fraction of function operations was picked from a few robot models and
+    polynomial benchmarks.  Pass 'sample' to auto_cse to rank the collectors
+    by the op count they actually reach on a sample of the expressions.
+
+    """
+
+    if stats['functions'] > 0.3:
+        # sums of products of function calls (e.g. trigonometric terms of dynamics models)
+        # are best shared by the pairwise Add/Mul intersections of _fast_cse
+        return ['fast_cse', 'subexprs+sympy_cse', 'subexprs', 'sympy_cse', 'whole']
+    else:
+        # polynomial like expressions are best shared by the commutative argset search of Subexprs
+        return ['subexprs+sympy_cse', 'subexprs', 'sympy_cse', 'fast_cse', 'whole']
+
+
+def sample_order( exprs, names=None, sample=20, cost=None ):
+    """Rank collectors by the code cost they reach on a sample of exprs.
+
+    Each collector in 'names' (all by default, in the given order for ties)
+    is run on up to 'sample' evenly spaced expressions and the resulting code
+    is priced with 'cost' (a costmodel.CostModel, the default one if None).
+    Collectors failing on the sample are left out.
+    Returns a list of (name, cost) from cheapest to most expensive code.
+
+    """
+
+    from . import costmodel
+    if cost is None:
+        cost = costmodel.CostModel()
+
+    if isinstance(exprs, sympy.Basic) and not isinstance(exprs, sympy.MatrixBase):
+        exprs = [exprs]
+    exprs = list(exprs)
+    step = max(1, len(exprs) // sample)
+    exprs = exprs[::step][:sample]
+
+    funcs = dict((name, func) for name, func, predict in collectors)
+    if names is None:
+        names = [name for name, func, predict in collectors]
+
+    ranked = []
+    for name in names:
+        try:
+            code = funcs[name](exprs)
+            code_cost = cost.code_cost(code)
+        except Exception as e:
+            logger.warning('sample_order: %s failed on the sample (%s: %s)', name, type(e).__name__, e)
+            continue
+        ranked.append((name, code_cost))
+
+    ranked.sort(key=lambda item: item[1])
+    return ranked
+
+
+def collector_candidates( stats, budget=None, order=None ):
+    """Collectors in the order they should be tried for the given time budget.
+
+    'order' is a list of collector names from best to worst op count
+    (_quality_order(stats) if None).  Collectors predicted to run within
+    budget come first, in that order; the others follow from fastest to
+    slowest (with no budget, all follow the order).
+    Returns a list of (name, collector function, predicted time, reason).
+
+    """
+
+    models = dict((name, (func, predict(stats))) for name, func, predict in collectors)
+    if order is None:
+        order = _quality_order(stats)
+
+    shape = '%d nodes, %d%% Add/Mul (Add/Mul ratio %.2f), %d%% functions, depth %d, %d outputs' % (
+        stats['nodes'], 100 * stats['addmul'], stats['add_mul_ratio'], 100 * stats['functions'],
+        stats['depth'], stats['outputs'])
+
+    if budget is None:
+        return [(name, models[name][0], models[name][1], 'best expected op count, no time budget; ' + shape)
+                for name in order]
+
+    candidates = []
+    for name in order:
+        func, predicted = models[name]
+        if predicted <= budget:
+            reason = 'best expected op count predicted within budget (%.3gs <= %.3gs); ' % (predicted, budget)
+            candidates.append((name, func, predicted, reason + shape))
+
+    for name in sorted(order, key=lambda name: models[name][1]):
+        func, predicted = models[name]
+        if predicted > budget:
+            reason = 'no collector predicted within budget (%.3gs), fastest one (%.3gs); ' % (budget, predicted)
+            candidates.append((name, func, predicted, reason + shape))
+
+    return candidates
+
+
+def select_collector( stats, budget=None ):
+    """Select the collector with the best expected op count predicted to run within budget.
+
+    Returns (name, collector function, predicted time, reason).
+
+    """
+
+    return collector_candidates(stats, budget)[0]
+
+
+def auto_cse( exprs, budget=None, sample=None ):
+    """Collect the subexpressions of exprs with an automatically selected collector.
+
+    The collector (Subexprs, WholeSubexprs, _fast_cse.cse, sympy.cse or
+    Subexprs followed by optimization.common_subexpr_elim) is selected from
+    the expression statistics (see expr_stats and select_collector) to meet
+    the time 'budget' (in seconds) with the best expected op count; the
+    decision and its reason are logged.
+    If 'sample' is given, the collectors predicted within budget are instead
+    ranked by the op count they reach on that many expressions (see
+    sample_order).
+    A collector raising an exception is logged and the next candidate is
+    tried.
+
+    Returns (code, decision) where decision is a dict with the 'collector'
+    name, the 'reason', the 'predicted_time', the 'stats' and the 'failed'
+    list of (name, error) of the collectors tried before.
+
+    """
+
+    stats = expr_stats(exprs)
+
+    order = None
+    if sample:
+        order = _quality_order(stats)
+        predicted = dict((name, predict(stats)) for name, func, predict in collectors)
+        names = [name for name in order if budget is None or predicted[name] <= budget]
+        ranked = [name for name, code_cost in sample_order(exprs, names, sample)]
+        order = ranked + [name for name in order if name not in names]
+
+    failed = []
+    for name, func, predicted, reason in collector_candidates(stats, budget, order):
+        if sample and name in ranked:
+            reason = 'best op count on a %d expressions sample; ' % sample + reason.split('; ', 1)[1]
+        logger.info('auto_cse: using %s (%s)', name, reason)
+        try:
+            code = func(exprs)
+        except Exception as e:
+            error = '%s: %s' % (type(e).__name__, e)
+            logger.warning('auto_cse: %s failed (%s)', name, error)
+            failed.append((name, error))
+            continue
+        decision = {'collector': name, 'reason': reason, 'predicted_time': predicted, 'stats': stats,
+                    'failed': failed}
+        return code, decision
+
+    raise Exception('auto_cse: all collectors failed (%s).' % '; '.join('%s: %s' % f for f in failed))
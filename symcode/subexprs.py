@@ -1,13 +1,36 @@
 import sympy
 import sympy.utilities
-from sympy.simplify.cse_main import cse_optimizations, preprocess_for_cse, postprocess_for_cse
+from sympy.simplify.cse_main import preprocess_for_cse, postprocess_for_cse
+try:
+    from sympy.simplify.cse_main import cse_optimizations
+except ImportError: # newer SymPy
+    from sympy.simplify import cse_opts
+    cse_optimizations = [(cse_opts.sub_pre, cse_opts.sub_post)]
 
 import collections
+import itertools
+try:
+    from time import perf_counter
+except ImportError: # Python 2
+    from time import time as perf_counter
 
 
 class Subexprs(object):
+    """Subexpressions collector.
+
+    With 'stats' (or a 'trace' callback), collect keeps statistics in the
+    'stats' dict (see _new_stats): counts of the parsed expressions ('exprs'),
+    visited nodes, argset comparisons, intersections of more than one
+    argument and argset splits, and the time spent in each phase ('time':
+    preprocess, parse, and, included in parse, the argset scan and the sympy
+    constructor calls). 'trace' is called as trace(index, out_expr, stats)
+    after each parsed expression; see also table_sizes. Otherwise stats is
+    None and no bookkeeping is done.
+
+    """
         
-    def __init__(self, optimizations=None, postprocess=None):
+    def __init__(self, optimizations=None, postprocess=None, factor_adds=False, canonical_coeffs=False, decompose_powers=False, max_argsets=None,
+                 stats=False, trace=None):
         
         if optimizations is None:
             # Pull out the default here just in case there are some weird
@@ -15,13 +38,68 @@ class Subexprs(object):
             optimizations = list(cse_optimizations)
         self._optimizations = optimizations
         self._postprocess = postprocess
+        self._factor_adds = factor_adds
+        self._canonical_coeffs = canonical_coeffs
+        self._decompose_powers = decompose_powers
+        self._max_argsets = max_argsets
         
         self._tmp_symbols = sympy.utilities.iterables.numbered_symbols('tmp', start=0, real=True)
         
         self._subexp_iv = dict()
         self._commutatives = dict()
+        self._powers = dict()
+        self._power_factors = set()
+        
+        # argset search tables memory budget bookkeeping
+        self._argsets_count = 0
+        self._argset_stats = dict() # id(argset) -> [hits, last hit tick]
+        self._tick = 0
+        self._evicted_iv = dict() # ivar -> subexpression, of evicted argsets
+        self._evicted_subexprs = set() # evicted subexpressions, to count the missed matches
+        self.eviction_stats = {'evicted': 0, 'evicted_args': 0, 'evicted_hits': 0, 'missed_matches': 0}
+        
+        self.estimated_cost = None
+        
+        self._trace = trace
+        self.stats = self._new_stats() if stats or trace is not None else None
+        
+    def __getstate__(self):
+        
+        state = dict(self.__dict__)
+        # the temporaries generator is restarted after the last temporary,
+        # and the argset hit stats, keyed by argset ids, are kept by position
+        ivars = list(self._subexp_iv.values()) + list(self._evicted_iv)
+        state['_tmp_symbols'] = 1 + max([int(iv.name[3:]) for iv in ivars if iv.is_Symbol and iv.name.startswith('tmp')] + [-1])
+        state['_argset_stats'] = {exprtype: [self._argset_stats.get(id(argset)) for argset in argsets]
+                                  for exprtype, (argsets, orderlens) in self._commutatives.items()}
+        state['_trace'] = None
+        return state
+    
+    def __setstate__(self, state):
+        
+        self.__dict__.update(state)
+        self._tmp_symbols = sympy.utilities.iterables.numbered_symbols('tmp', start=state['_tmp_symbols'], real=True)
+        self._argset_stats = dict()
+        for exprtype, stats in state['_argset_stats'].items():
+            for argset, argset_stats in zip(self._commutatives[exprtype][0], stats):
+                if argset_stats is not None:
+                    self._argset_stats[id(argset)] = argset_stats
+        
+    @staticmethod
+    def _new_stats():
+        return {'exprs': 0, 'nodes': 0, 'argset_comparisons': 0, 'intersections': 0, 'splits': 0,
+                'time': {'preprocess': 0.0, 'parse': 0.0, 'argset_scan': 0.0, 'construct': 0.0}}
+    
+    def table_sizes(self):
+        """Sizes of the collector tables: argsets and subexpressions by expression type, and powers."""
         
+        subexprs = collections.Counter(type(subexpr).__name__ for subexpr in self._subexp_iv)
+        return {'argsets': {exprtype.__name__: len(argsets) for exprtype, (argsets, orderlens) in self._commutatives.items()},
+                'subexprs': dict(subexprs),
+                'powers': sum(len(powers) for powers in self._powers.values()),
+                'evicted': len(self._evicted_iv)}
         
+
     class _ordered_len(object):
         def __init__(self):
             self.lenidxs = [0]
@@ -37,17 +115,103 @@ class Subexprs(object):
             l = len(list.pop(index))
             for j in range(l,len(self.lenidxs)):
                 self.lenidxs[j] -= 1
+        def reset(self, list):
+            counts = [0]*(max([2] + [len(item) for item in list]) + 1)
+            for item in list:
+                counts[len(item)] += 1
+            self.lenidxs = [0]*len(counts)
+            total = 0
+            for l, count in enumerate(counts):
+                total += count
+                self.lenidxs[l] = total
+    
+    def _evict_argsets(self):
+        """Evict the least (and least recently) matched argsets from the search tables.
+        
+        The ivar definitions of evicted argsets are kept apart (so they can no
+        longer be matched nor overwritten), thus only sharing with later
+        expressions is given up; eviction_stats reports the evicted argsets,
+        their elements, their hits and the later exact matches missed.
+        
+        """
+        
+        ranked = []
+        for exprtype, (argsets, argset_orderlens) in self._commutatives.items():
+            for argset in argsets:
+                ranked.append((self._argset_stats.get(id(argset), [0, 0]), exprtype, argset))
+        ranked.sort(key=lambda r: r[0])
+        
+        # evict down to 3/4 of the budget so evictions are amortized
+        nevict = len(ranked) - (3*self._max_argsets)//4
+        evicted = dict()
+        for stats, exprtype, argset in ranked[:nevict]:
+            evicted.setdefault(exprtype, set()).add(id(argset))
+            self._argset_stats.pop(id(argset), None)
+            subexpr = exprtype(*argset)
+            self._evicted_iv[self._subexp_iv.pop(subexpr)] = subexpr
+            self._evicted_subexprs.add(subexpr)
+            self.eviction_stats['evicted'] += 1
+            self.eviction_stats['evicted_args'] += len(argset)
+            self.eviction_stats['evicted_hits'] += stats[0]
+        
+        for exprtype, ids in evicted.items():
+            argsets, argset_orderlens = self._commutatives[exprtype]
+            argsets[:] = [argset for argset in argsets if id(argset) not in ids]
+            argset_orderlens.reset(argsets)
+        
+        self._argsets_count = len(ranked) - max(nevict, 0)
+            
+    def _new_argset(self, exprtype, args, hits, args_to_insert, inserted_hits):
+        """Return the ivar of exprtype(*args), queueing args for insertion if it is new.
+        
+        Each argset key has a single argset in the tables, so an argset
+        rebuilt equal to an existing one reuses its ivar instead of
+        overwriting (and thus losing) its definition.
+        
+        """
+        subexpr = exprtype(*args)
+        ivar = self._subexp_iv.get(subexpr, None)
+        if ivar is None:
+            ivar = next(self._tmp_symbols)
+            self._subexp_iv[subexpr] = ivar
+            args_to_insert.append(args)
+            inserted_hits[id(args)] = hits
+        return ivar
+    
+    def _replace_argset(self, exprtype, i, diff_args, ivar, stats, args_to_remove, args_to_insert, inserted_hits):
+        """Queue the replacement of argset i by diff_args plus ivar, keeping its ivar.
+        
+        The argset is left as is if the replacement key is already taken.
+        
+        """
+        argsets = self._commutatives[exprtype][0]
+        args = diff_args
+        args.add(ivar)
+        subexpr = exprtype(*args)
+        if subexpr in self._subexp_iv:
+            return
+        self._subexp_iv[subexpr] = self._subexp_iv.pop(exprtype(*argsets[i]))
+        args_to_remove.append(i)
+        args_to_insert.append(args)
+        inserted_hits[id(args)] = stats[0] if stats else 0
             
     def _parse_commutative(self, expr):
         
         exprtype = type(expr)
         args_input = set(expr.args)
         
+        track = self._max_argsets is not None
+        if track:
+            self._tick += 1
+        
         if exprtype not in self._commutatives:
             argsets = []
             argset_orderlens = self._ordered_len()
             argset_orderlens.insert(argsets, args_input)
             self._commutatives[exprtype] = (argsets, argset_orderlens)
+            if track:
+                self._argset_stats[id(args_input)] = [0, self._tick]
+                self._argsets_count += 1
             ivar = next(self._tmp_symbols)
             self._subexp_iv[expr] = ivar
             return ivar      
@@ -58,12 +222,19 @@ class Subexprs(object):
         ivar = None
         args_to_remove = []
         args_to_insert = []
+        inserted_hits = dict()
+        stats = None
         
         # for 2 args input exprs, bypass comparison with other 2 args exprs
         if len(args_input) == 2:
             init = argset_orderlens.lenidxs[2]
         else:
             init = 0
+        
+        counters = self.stats
+        if counters is not None:
+            i = init - 1
+            t0 = perf_counter()
             
         for i in range(init, len(argsets)):
             args_other = argsets[i]
@@ -71,20 +242,28 @@ class Subexprs(object):
             com = args_input.intersection(args_other)
             if len(com) > 1:
                 
+                if counters is not None:
+                    counters['intersections'] += 1
+                
+                if track:
+                    stats = self._argset_stats.setdefault(id(args_other), [0, 0])
+                    stats[0] += 1
+                    stats[1] = self._tick
+                
                 diff_args_input = args_input.difference(com)
                 diff_args_other = args_other.difference(com)
                 
-                if not diff_args_input: # args_input is strict subset of args_other
+                if not diff_args_input and not diff_args_other: # args_input equals args_other
+                    
+                    ivar = self._subexp_iv[exprtype(*args_other)]
+                    break
+                
+                elif not diff_args_input: # args_input is strict subset of args_other
                     
-                    ivar = next(self._tmp_symbols)
-                    self._subexp_iv[exprtype(*args_input)] = ivar
-                    args_to_insert.append(args_input)
+                    if counters is not None: counters['splits'] += 1
                     
-                    args_other = diff_args_other
-                    args_other.add(ivar)
-                    self._subexp_iv[exprtype(*args_other)] = self._subexp_iv.pop(exprtype(*argsets[i]))
-                    args_to_remove.append(i)
-                    args_to_insert.append(args_other)
+                    ivar = self._new_argset(exprtype, args_input, 1, args_to_insert, inserted_hits)
+                    self._replace_argset(exprtype, i, diff_args_other, ivar, stats, args_to_remove, args_to_insert, inserted_hits)
                     
                     break
                 
@@ -100,54 +279,201 @@ class Subexprs(object):
                 
                 else: # args_input != com != args_other
                     
-                    ivar_com = next(self._tmp_symbols)
-                    self._subexp_iv[exprtype(*com)] = ivar_com
-                    args_to_insert.append(com) #argsets.append(com)
+                    if counters is not None: counters['splits'] += 1
                     
-                    args_other = diff_args_other
-                    args_other.add(ivar_com)
-                    self._subexp_iv[exprtype(*args_other)] = self._subexp_iv.pop(exprtype(*argsets[i]))
-                    args_to_remove.append(i)
-                    args_to_insert.append(args_other)
+                    ivar_com = self._new_argset(exprtype, com, 1, args_to_insert, inserted_hits)
+                    self._replace_argset(exprtype, i, diff_args_other, ivar_com, stats, args_to_remove, args_to_insert, inserted_hits)
                     
                     args_input = diff_args_input
                     args_input.add(ivar_com)
                     
-                    if len(args_input) == 2:
+                    ivar = self._subexp_iv.get(exprtype(*args_input), None)
+                    
+                    if ivar or len(args_input) == 2:
                         break
         
+        if counters is not None:
+            counters['argset_comparisons'] += i - init + 1
+            counters['time']['argset_scan'] += perf_counter() - t0
+        
         if ivar is None:
-            ivar = next(self._tmp_symbols)
-            self._subexp_iv[exprtype(*args_input)] = ivar
-            args_to_insert.append(args_input)
+            subexpr = exprtype(*args_input)
+            if track and subexpr not in self._subexp_iv and subexpr in self._evicted_subexprs:
+                self.eviction_stats['missed_matches'] += 1
+            ivar = self._new_argset(exprtype, args_input, 0, args_to_insert, inserted_hits)
         
         for i in reversed(sorted(args_to_remove)):
+            if track:
+                self._argset_stats.pop(id(argsets[i]), None)
             argset_orderlens.pop(argsets, i)
         for args in args_to_insert:
+            if track:
+                self._argset_stats[id(args)] = [inserted_hits.get(id(args), 0), self._tick]
             argset_orderlens.insert(argsets, args)
         
+        if track:
+            self._argsets_count += len(args_to_insert) - len(args_to_remove)
+            if self._argsets_count > self._max_argsets:
+                self._evict_argsets()
+        
+        return ivar
+        
+    def _parse_factored_add(self, terms):
+        
+        # index the terms by their (non numeric) factors
+        factor_terms = collections.OrderedDict()
+        for i, term in enumerate(terms):
+            factors = term.args if term.is_Mul else (term,)
+            for factor in factors:
+                if not factor.is_Number:
+                    factor_terms.setdefault(factor, set()).add(i)
+        
+        factor = None
+        for f, idxs in factor_terms.items():
+            if len(idxs) > 1 and (factor is None or len(idxs) > len(factor_terms[factor])):
+                factor = f
+        
+        if factor is None:
+            return self._parse_node(sympy.Add(*map(self._parse, terms)))
+        
+        # a*x + a*y + ... + b -> a*(x + y + ...) + b
+        cofactors = []
+        other_terms = []
+        for i, term in enumerate(terms):
+            if i in factor_terms[factor]:
+                if term == factor:
+                    cofactors.append(sympy.S.One)
+                else:
+                    args = list(term.args)
+                    args.remove(factor)
+                    cofactors.append(sympy.Mul(*args))
+            else:
+                other_terms.append(term)
+        
+        cofactor = self._parse_factored_add(cofactors)
+        product = self._parse_node(sympy.Mul(self._parse(factor), cofactor))
+        
+        if not other_terms:
+            return product
+        return self._parse_factored_add([product] + other_terms)
+    
+    def _parse_node(self, subexpr):
+        
+        if subexpr.is_Atom:
+            return subexpr
+        
+        if self._canonical_coeffs:
+            # share a subexpression with its negation and rational multiples:
+            # 2*x*y -> 2*ivar(x*y), 2*a - 4*b -> 2*ivar(a - 2*b), b - a -> -ivar(a - b)
+            if subexpr.is_Mul:
+                coeff, rest = subexpr.as_coeff_Mul(rational=True)
+            elif subexpr.is_Add:
+                coeff, rest = subexpr.as_content_primitive()
+                if rest.could_extract_minus_sign():
+                    coeff, rest = -coeff, -rest
+            else:
+                coeff = sympy.S.One
+            if coeff is not sympy.S.One:
+                return coeff*self._parse_node(rest)
+        
+        if self._decompose_powers and subexpr.is_Pow:
+            return self._parse_power(subexpr.base, subexpr.exp)
+        
+        if subexpr in self._subexp_iv:
+            return self._subexp_iv[subexpr]
+        
+        if subexpr.is_Mul or subexpr.is_Add:
+            return self._parse_commutative(subexpr)
+        else:
+            return self._parse_opaque(subexpr)
+    
+    def _parse_opaque(self, subexpr):
+        
+        if subexpr.is_Atom:
+            return subexpr
+        
+        if subexpr in self._subexp_iv:
+            return self._subexp_iv[subexpr]
+        
+        ivar = next(self._tmp_symbols)
+        self._subexp_iv[subexpr] = ivar
+        return ivar
+    
+    def _parse_power(self, base, exp):
+        
+        if exp is sympy.S.One:
+            return base
+        
+        powers = self._powers.setdefault(base, dict())
+        if exp in powers:
+            return powers[exp]
+        
+        if exp.is_Integer and exp > 2:
+            # x**n -> x**k * x**(n-k), reusing the largest already computed power
+            known = [k for k in powers if k.is_Integer and 1 < k < exp]
+            k = max(known) if known else exp // 2
+            a = self._parse_power(base, k)
+            b = self._parse_power(base, exp - k)
+            if a == b:
+                ivar = self._parse_power(a, sympy.S(2))
+                self._power_factors.add(a)
+            else:
+                ivar = self._parse_node(sympy.Mul(a, b))
+                self._power_factors.update((a, b))
+        
+        elif exp.is_Rational and exp.q == 2 and exp > 1:
+            # x**(n/2) -> x**((n-1)/2) * sqrt(x)
+            a = self._parse_power(base, exp - sympy.S.Half)
+            b = self._parse_power(base, sympy.S.Half)
+            ivar = self._parse_node(sympy.Mul(a, b))
+            self._power_factors.update((a, b))
+        
+        elif exp.is_Rational and (exp.q == 1 or exp.q == 2) and exp < 0 and exp is not sympy.S.NegativeOne:
+            # x**-n -> 1/x**n
+            ivar = self._parse_power(self._parse_power(base, -exp), sympy.S.NegativeOne)
+        
+        else:
+            ivar = self._parse_opaque(sympy.Pow(base, exp))
+        
+        powers[exp] = ivar
         return ivar
         
     def _parse(self, expr):
+        
+        if self.stats is not None:
+            self.stats['nodes'] += 1
             
         if expr.is_Atom:
             # Exclude atoms, since there is no point in renaming them.
             return expr
         
-        if sympy.iterables.iterable(expr):
+        if sympy.utilities.iterables.iterable(expr):
             return expr
         
-        subexpr = type(expr)(*map(self._parse, expr.args))
-
-        if subexpr in self._subexp_iv:
-            return self._subexp_iv[subexpr]
+        if self._factor_adds and expr.is_Add:
+            return self._parse_factored_add(expr.args)
         
-        if subexpr.is_Mul or subexpr.is_Add:
-            return self._parse_commutative(subexpr)
+        args = list(map(self._parse, expr.args))
+        
+        if self.stats is None:
+            subexpr = type(expr)(*args)
         else:
-            ivar = next(self._tmp_symbols)
-            self._subexp_iv[subexpr] = ivar
-            return ivar
+            t0 = perf_counter()
+            subexpr = type(expr)(*args)
+            self.stats['time']['construct'] += perf_counter() - t0
+
+        return self._parse_node(subexpr)
+    
+    def _parse_traced(self, expr):
+        
+        stats = self.stats
+        t0 = perf_counter()
+        out_expr = self._parse(expr)
+        stats['time']['parse'] += perf_counter() - t0
+        stats['exprs'] += 1
+        if self._trace is not None:
+            self._trace(stats['exprs'] - 1, out_expr, stats)
+        return out_expr
 
 
     def collect(self, exprs):
@@ -159,9 +485,14 @@ class Subexprs(object):
             is_single_expr = False
         
         # Preprocess the expressions to give us better optimization opportunities.
+        if self.stats is not None: t0 = perf_counter()
         prep_exprs = [preprocess_for_cse(e, self._optimizations) for e in exprs]
         
-        out_exprs = map(self._parse, prep_exprs)
+        if self.stats is None:
+            out_exprs = list(map(self._parse, prep_exprs))
+        else:
+            self.stats['time']['preprocess'] += perf_counter() - t0
+            out_exprs = list(map(self._parse_traced, prep_exprs))
             
         if is_single_expr:
             return out_exprs[0]
@@ -169,13 +500,60 @@ class Subexprs(object):
             return sympy.Matrix(exprs.rows, exprs.cols, out_exprs)
         else:
             return out_exprs
+
+    def collect_stream(self, exprs, spill, chunksize=1000, clearcache=True):
+        """Collect an iterable of expressions in chunks, spilling the output references to 'spill'.
+
+        Only a chunk of the input expressions is resident at a time, so memory
+        is bound by the collector tables: the collected output expressions
+        (references to the collected subexpressions) are written, one srepr per
+        line, to the 'spill' file (a path or an open file) and can be read back
+        lazily with iter_exprs, e.g. se.get(list(iter_exprs(spill))).
+        With 'clearcache', the SymPy cache, which would otherwise keep the
+        parsed input expressions alive, is cleared after each chunk.
+
+        Returns the number of collected expressions.
+
+        """
+
+        if isinstance(spill, str):
+            with open(spill, 'w') as f:
+                return self.collect_stream(exprs, f, chunksize, clearcache)
+
+        exprs = iter(exprs)
+        count = 0
+        while True:
+            chunk = list(itertools.islice(exprs, chunksize))
+            if not chunk:
+                break
+            for out_expr in self.collect(chunk):
+                spill.write(sympy.srepr(out_expr) + '\n')
+            count += len(chunk)
+            del chunk
+            if clearcache:
+                sympy.core.cache.clear_cache()
+        spill.flush()
+
+        return count
+
+    def get(self, exprs=None, symbols=None, cost=None):
+        """Return code (subexpressions, output expressions) for the collected exprs.
+
+        By default, the subexpressions used more than once are extracted.
+        If a costmodel.CostModel is passed as 'cost', a subexpression is
+        extracted if recomputing it at each use costs more than a temporary,
+        or if it is an expensive operation (see CostModel); the total estimated
+        cost of the returned code is then stored in 'estimated_cost'.
+        If 'symbols' is a function, it is called with each internal temporary
+        (tmp0, tmp1, ...) to name the extracted subexpression, so names do not
+        depend on the order of extraction (see incremental).
+
+        """
         
-    
-    def get(self, exprs=None, symbols=None):
-        
+        naming = callable(symbols)
         if symbols is None:
             symbols = sympy.utilities.iterables.numbered_symbols()
-        else:
+        elif not naming:
             # In case we get passed an iterable with an __iter__ method instead of
             # an actual iterator.
             symbols = iter(symbols)
@@ -185,10 +563,12 @@ class Subexprs(object):
         
         # Find all of the repeated subexpressions.
         
-        ivar_se = {iv:se for se,iv in self._subexp_iv.iteritems()}
+        ivar_se = {iv:se for se,iv in self._subexp_iv.items()}
+        ivar_se.update(self._evicted_iv)
         
         used_ivs = set()
         repeated = set()
+        uses = collections.Counter()
         
         def _find_repeated_subexprs(subexpr):
             if subexpr.is_Atom:
@@ -197,14 +577,50 @@ class Subexprs(object):
                 symbs = subexpr.args
             for symb in symbs:
                 if symb in ivar_se:
+                    uses[symb] += 1
                     if symb not in used_ivs:
                         _find_repeated_subexprs(ivar_se[symb])
                         used_ivs.add(symb)
                     else:
                         repeated.add(symb)
+                elif not symb.is_Atom:
+                    _find_repeated_subexprs(symb)
         
         for expr in exprs:
             _find_repeated_subexprs(expr)
+        
+        if cost is not None:
+            
+            # Decide (children first) which subexpressions are worth a temporary.
+            
+            repeated = set()
+            inline_cost = dict()
+            
+            def _subtree_cost(subexpr):
+                c = cost.node_cost(subexpr)
+                for arg in subexpr.args:
+                    if arg in ivar_se:
+                        c += _iv_cost(arg)
+                    elif not arg.is_Atom:
+                        c += _subtree_cost(arg)
+                return c
+            
+            def _iv_cost(ivar):
+                if ivar not in inline_cost:
+                    subexpr = ivar_se[ivar]
+                    c = _subtree_cost(subexpr)
+                    if cost.node_cost(subexpr) >= cost.materialize_cost or \
+                       (uses[ivar] - 1) * c > cost.tmp_cost:
+                        repeated.add(ivar)
+                        c = 0
+                    inline_cost[ivar] = c
+                return inline_cost[ivar]
+            
+            for ivar in used_ivs:
+                _iv_cost(ivar)
+        
+        # power factors are kept, otherwise they would be merged back into powers
+        repeated |= used_ivs & self._power_factors
             
         # Substitute symbols for all of the repeated subexpressions.
         # remove temporary replacements that weren't used more than once
@@ -222,12 +638,14 @@ class Subexprs(object):
                         subexpr = ivar_se[symb]
                         subexpr = type(subexpr)(*_get_subexprs(subexpr.args))
                         if symb in repeated:
-                            ivar = next(symbols)
+                            ivar = symbols(symb) if naming else next(symbols)
                             ordered_iv_se[ivar] = subexpr
                             tmpivs_ivs[symb] = ivar
                             args[i] = ivar
                         else:
                             args[i] = subexpr
+                elif not symb.is_Atom:
+                    args[i] = type(symb)(*_get_subexprs(symb.args))
             return args
 
         out_exprs = _get_subexprs(exprs)    
@@ -242,9 +660,11 @@ class Subexprs(object):
 
         if isinstance(exprs, sympy.Matrix):
             out_exprs = sympy.Matrix(exprs.rows, exprs.cols, out_exprs)
+        if cost is not None:
+            self.estimated_cost = cost.code_cost((list(ordered_iv_se.items()), out_exprs))
         if self._postprocess is None:
-            return ordered_iv_se.items(), out_exprs
-        return self._postprocess(ordered_iv_se.items(), out_exprs)
+            return list(ordered_iv_se.items()), out_exprs
+        return self._postprocess(list(ordered_iv_se.items()), out_exprs)
 
 
 
@@ -253,6 +673,16 @@ def fast_cse(exprs, symbols='aux'):
     return se.get(se.collect(exprs))
 
 
+def iter_exprs(path, parse=sympy.sympify):
+    """Lazily iterate the expressions of a file with one expression (srepr or text) per line."""
+    
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield parse(line)
+
+
 
 
 
@@ -0,0 +1,185 @@
+
+import string
+
+
+# C libm functions provided lane-wise (name, number of arguments); exp, log,
+# sin, cos, tan and pow have vectorized polynomial implementations
+lanewise_funcs = [('sqrt', 1), ('cbrt', 1), ('fabs', 1), ('floor', 1), ('ceil', 1),
+                  ('asin', 1), ('acos', 1), ('atan', 1), ('atan2', 2), ('sinh', 1), ('cosh', 1), ('tanh', 1),
+                  ('asinh', 1), ('acosh', 1), ('atanh', 1), ('exp2', 1), ('expm1', 1), ('log10', 1),
+                  ('log2', 1), ('log1p', 1), ('erf', 1), ('erfc', 1), ('tgamma', 1), ('lgamma', 1), ('hypot', 2)]
+
+poly_funcs = ['exp', 'log', 'sin', 'cos', 'tan', 'pow']
+
+
+_prelude = string.Template('''
+#ifndef SYMCODE_${P}
+#define SYMCODE_${P}
+
+#include <math.h>
+
+typedef ${T} ${P}_t __attribute__((vector_size(${BYTES}), aligned(sizeof(${T}))));
+typedef ${I} ${P}_i __attribute__((vector_size(${BYTES})));
+
+#define ${P}_ZERO ((${P}_t){0})
+
+static inline ${P}_t ${P}_select( ${P}_i mask, ${P}_t a, ${P}_t b )
+{
+  return (${P}_t)((mask & (${P}_i)a) | (~mask & (${P}_i)b));
+}
+
+static inline ${P}_t ${P}_round( ${P}_t x, ${P}_i* n )
+{
+  /* round to nearest (|x| < 2^${MB1}), also returned as integers */
+  ${P}_t t = x + ${MAGIC};
+  *n = (${P}_i)t - (${P}_i)(${P}_ZERO + ${MAGIC});
+  return t - ${MAGIC};
+}
+
+static inline ${P}_t ${P}_powi( ${P}_t a, int n )
+{
+  ${P}_t r = ${P}_ZERO + 1.0;
+  int m = n < 0 ? -n : n;
+  while (m) {
+    if (m & 1) r *= a;
+    a *= a;
+    m >>= 1;
+  }
+  return n < 0 ? 1.0/r : r;
+}
+
+static inline ${P}_t ${P}_exp( ${P}_t x )
+{
+  ${P}_i n;
+  ${P}_t xc = ${P}_select(x > ${EXPHI}, ${P}_ZERO + ${EXPHI}, ${P}_select(x < ${EXPLO}, ${P}_ZERO + ${EXPLO}, x));
+  ${P}_t k = ${P}_round(xc*1.4426950408889634, &n);
+  ${P}_t r = xc - k*0.693145751953125 - k*1.4286068203094173e-06;
+  ${P}_t p = ${P}_ZERO + 1.6059043836821613e-10;
+  p = p*r + 2.08767569878681e-09;
+  p = p*r + 2.505210838544172e-08;
+  p = p*r + 2.755731922398589e-07;
+  p = p*r + 2.7557319223985893e-06;
+  p = p*r + 2.48015873015873e-05;
+  p = p*r + 0.0001984126984126984;
+  p = p*r + 0.001388888888888889;
+  p = p*r + 0.008333333333333333;
+  p = p*r + 0.041666666666666664;
+  p = p*r + 0.16666666666666666;
+  p = p*r + 0.5;
+  p = p*r + 1.0;
+  p = p*r + 1.0;
+  p *= (${P}_t)((n + ${BIAS}) << ${MB});
+  p = ${P}_select(x > ${EXPHI}, ${P}_ZERO + INFINITY, p);
+  p = ${P}_select(x < ${EXPLO}, ${P}_ZERO, p);
+  return ${P}_select(x != x, x, p);
+}
+
+static inline ${P}_t ${P}_log( ${P}_t x )
+{
+  ${P}_i bits = (${P}_i)x;
+  ${P}_i e = ((bits >> ${MB}) & ${EXPMASK}) - ${BIAS};
+  ${P}_t m = (${P}_t)((bits & ${MANTMASK}) | ((${P}_i)(${P}_ZERO + 1.0) & ~${MANTMASK}));
+  ${P}_i big = m > 1.4142135623730951;
+  m = ${P}_select(big, m*0.5, m);
+  e -= big;
+  ${P}_t s = (m - 1.0)/(m + 1.0);
+  ${P}_t z = s*s;
+  ${P}_t p = ${P}_ZERO + 0.10526315789473684;
+  p = p*z + 0.11764705882352941;
+  p = p*z + 0.13333333333333333;
+  p = p*z + 0.15384615384615385;
+  p = p*z + 0.18181818181818182;
+  p = p*z + 0.2222222222222222;
+  p = p*z + 0.2857142857142857;
+  p = p*z + 0.4;
+  p = p*z + 0.6666666666666666;
+  p = p*z + 2.0;
+  ${P}_t ef = __builtin_convertvector(e, ${P}_t);
+  ${P}_t r = ef*0.693145751953125 + (s*p + ef*1.4286068203094173e-06);
+  r = ${P}_select(x == 0.0, ${P}_ZERO - INFINITY, r);
+  r = ${P}_select(x == INFINITY, x, r);
+  return ${P}_select(x < 0.0, ${P}_ZERO + NAN, ${P}_select(x != x, x, r));
+}
+
+static inline ${P}_t ${P}_sincos_q( ${P}_t x, int shift )
+{
+  /* sin(x + shift*pi/2) */
+  ${P}_i q;
+  ${P}_t k = ${P}_round(x*0.6366197723675814, &q);
+  ${P}_t r = x - k*${PIO2_1} - k*${PIO2_2} - k*${PIO2_3};
+  ${P}_t z = r*r;
+  ${P}_t s = ${P}_ZERO + -7.647163731819816e-13;
+  s = s*z + 1.6059043836821613e-10;
+  s = s*z - 2.505210838544172e-08;
+  s = s*z + 2.7557319223985893e-06;
+  s = s*z - 0.0001984126984126984;
+  s = s*z + 0.008333333333333333;
+  s = s*z - 0.16666666666666666;
+  s = r + r*z*s;
+  ${P}_t c = ${P}_ZERO + 4.779477332387385e-14;
+  c = c*z - 1.1470745597729725e-11;
+  c = c*z + 2.08767569878681e-09;
+  c = c*z - 2.755731922398589e-07;
+  c = c*z + 2.48015873015873e-05;
+  c = c*z - 0.001388888888888889;
+  c = c*z + 0.041666666666666664;
+  c = c*z - 0.5;
+  c = c*z + 1.0;
+  q += shift;
+  ${P}_t v = ${P}_select((q & 1) != 0, c, s);
+  return ${P}_select((q & 2) != 0, -v, v);
+}
+
+static inline ${P}_t ${P}_sin( ${P}_t x ) { return ${P}_sincos_q(x, 0); }
+static inline ${P}_t ${P}_cos( ${P}_t x ) { return ${P}_sincos_q(x, 1); }
+static inline ${P}_t ${P}_tan( ${P}_t x ) { return ${P}_sincos_q(x, 0)/${P}_sincos_q(x, 1); }
+static inline ${P}_t ${P}_pow( ${P}_t a, ${P}_t b ) { return ${P}_exp(b*${P}_log(a)); }
+''')
+
+_lanewise = string.Template('''static inline ${P}_t ${P}_${NAME}( ${ARGS} )
+{
+  ${P}_t r;
+  for (int i = 0; i < ${W}; i++) r[i] = ${NAME}(${CALL});
+  return r;
+}
+''')
+
+_params = {}
+_params['double'] = dict(T='double', I='long long', MB=52, MB1=51, BIAS=1023, EXPMASK='0x7ffLL',
+                         MANTMASK='0xfffffffffffffLL', MAGIC='6755399441055744.0', EXPLO='-708.0', EXPHI='709.0',
+                         PIO2_1='1.5707963267341256', PIO2_2='6.077100506303966e-11', PIO2_3='2.0222662487959506e-21')
+_params['float'] = dict(T='float', I='int', MB=23, MB1=22, BIAS=127, EXPMASK='0xff',
+                        MANTMASK='0x7fffff', MAGIC='12582912.0', EXPLO='-87.0', EXPHI='88.0',
+                        PIO2_1='1.5703125', PIO2_2='0.0004837512969970703', PIO2_3='7.549789954891882e-08')
+
+
+def prefix( width, precision='double' ):
+    """Name prefix of the vector types and functions of the given width and precision."""
+
+    return 'v' + str(width) + precision[0]
+
+
+def c_prelude( width, precision='double' ):
+    """C definitions of the vector types and math functions for 'width' lanes of 'precision'.
+
+    Uses GCC/Clang vector extensions; the names are prefixed by
+    prefix(width, precision), e.g. v4d_t and v4d_sin, and guarded against
+    redefinition. The polynomial functions are accurate to a few ulps for
+    normal numbers (subnormal inputs of log are not supported), and the
+    others are evaluated lane-wise with libm.
+
+    """
+
+    params = dict(_params[precision])
+    params['P'] = prefix(width, precision)
+    params['W'] = width
+    params['BYTES'] = width * (8 if precision == 'double' else 4)
+
+    code = _prelude.substitute(params)
+    for name, nargs in lanewise_funcs:
+        args = ', '.join(params['P'] + '_t a' + str(i) for i in range(nargs))
+        call = ', '.join('a' + str(i) + '[i]' for i in range(nargs))
+        code += '\n' + _lanewise.substitute(params, NAME=name, ARGS=args, CALL=call)
+    code += '\n#endif\n'
+
+    return code
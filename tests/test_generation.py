@@ -0,0 +1,36 @@
+import re
+
+import sympy
+import sympy.physics.hydrogen
+from sympy.abc import x
+
+import symcode
+
+
+def test_readme_example():
+    """The README flow: collect derivatives, get the code and generate C."""
+
+    n, l, Z = 6, 2, 6
+    expr = sympy.physics.hydrogen.R_nl(n, l, x, Z)
+
+    se = symcode.subexprs.Subexprs()
+    expr_diffs = []
+    for order in range(11):
+        diff = expr
+        for _ in range(order):
+            diff = diff.diff(x)
+        expr_diffs.append(se.collect(diff))
+
+    sym_code = se.get(expr_diffs)
+    c_code = symcode.generation.gen_c_func(sym_code, ['x'], 'diffs')
+
+    defined = set(re.findall(r'double (\w+) =', c_code))
+    used = set(re.findall(r'\b((?:x|tmp)\d+)\b', c_code))
+    assert used <= defined
+    assert not [name for name in used if name.startswith('tmp')]
+    assert c_code.count('out[') == 11
+
+    exprs = symcode.generation.code_back_to_exprs(sym_code)
+    for order, out in enumerate(exprs):
+        diff = expr.diff(x, order) if order else expr
+        assert abs(float((out - diff).subs(x, 0.7))) < 1e-9
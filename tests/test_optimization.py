@@ -0,0 +1,41 @@
+import sympy
+
+from symcode import optimization
+
+
+x = sympy.Symbol('q[0]', real=True)
+c0, c1 = sympy.symbols('c0 c1')
+
+
+def test_split_code_bounds_outputs():
+    """Many outputs over few subexpressions still give parts of bounded size."""
+
+    code = ([(c0, sympy.sin(x)), (c1, sympy.cos(x)*c0)], [c0*k + c1**2*k + x for k in range(1, 101)])
+    for max_items in [1, 7, 64]:
+        parts, arena_len = optimization.split_code(code, max_items)
+        assert max(len(subexprs) + len(outs) for subexprs, outs, stores in parts) <= max_items
+        assert sorted(i for subexprs, outs, stores in parts for i, expr in outs) == list(range(100))
+
+        values = {}
+        arena = [None]*arena_len
+        for subexprs, outs, stores in parts:
+            env = dict((sympy.Symbol('arena[%d]' % slot, real=True), value) for slot, value in enumerate(arena))
+            env[x] = 0.3
+            for iv, se in subexprs:
+                env[iv] = se.xreplace(env)
+            for i, expr in outs:
+                values[i] = float(expr.xreplace(env))
+            for slot, iv in stores:
+                arena[slot] = env[iv]
+        for i, expr in enumerate(code[1]):
+            expected = expr.xreplace({c1: sympy.cos(x)*sympy.sin(x)}).xreplace({c0: sympy.sin(x)}).subs(x, 0.3)
+            assert abs(values[i] - float(expected)) < 1e-12
+
+
+def test_horner_reuses_power_temporaries():
+    y, z, x2, x3 = sympy.symbols('y z x2 x3')
+    code = ([(x2, x**2), (x3, x**3)], [x3*y + x3*z + x3, x3*x2*y + x3*x2*z])
+    ivs, outs = optimization.horner(code)
+    assert outs[0] == x3*(y + z + 1)
+    assert outs[1] == x3*x2*(y + z)
+    assert not [p for out in outs for p in out.atoms(sympy.Pow) if p.base == x]
@@ -0,0 +1,46 @@
+import random
+
+import sympy
+
+from symcode import subexprs
+
+
+syms = sympy.symbols('a b c d e f g')
+
+
+def _random_exprs(seed, n=30):
+    """Sums of products of random symbol subsets, which share many argsets."""
+    rng = random.Random(seed)
+    exprs = []
+    for _ in range(n):
+        terms = [sympy.Mul(*rng.sample(syms, rng.randint(2, 6))) for _ in range(rng.randint(1, 3))]
+        exprs.append(sympy.Add(*terms))
+    return exprs
+
+
+def _max_error(code, exprs, seed=0):
+    rng = random.Random(seed)
+    values = dict((s, rng.uniform(0.5, 1.5)) for s in syms)
+    env = dict(values)
+    for iv, se in code[0]:
+        env[iv] = sympy.sympify(se).subs(env)
+    return max(abs(float(sympy.sympify(out).subs(env)) - float(expr.subs(values)))
+               for out, expr in zip(code[1], exprs))
+
+
+def test_collect_random_exprs():
+    for seed in range(10):
+        exprs = _random_exprs(seed)
+        se = subexprs.Subexprs()
+        code = se.get(se.collect(exprs))
+        assert _max_error(code, exprs) < 1e-9
+
+
+def test_collect_with_argset_budget():
+    for seed in range(10):
+        exprs = _random_exprs(seed)
+        for max_argsets in [2, 4, 8]:
+            se = subexprs.Subexprs(max_argsets=max_argsets)
+            code = se.get(se.collect(exprs))
+            assert _max_error(code, exprs) < 1e-9
+            assert sum(se.table_sizes()['argsets'].values()) <= max_argsets